@@ -0,0 +1,210 @@
+"""
+Online backup and restore of a banking database.
+
+Backups use SQLite's incremental backup API: pages are copied in small
+batches with a pause after each one, so live traffic keeps getting the
+disk and the CPU between batches. All batches are read from a single
+read transaction, which makes the copy a consistent snapshot even while
+deposits and transfers are being written, unlike copying the file; it
+also stops SQLite from restarting the backup after every write of
+another connection. In WAL mode writers are not blocked at all, with a
+rollback journal they wait until the backup is done.
+
+Every backup is checked with `PRAGMA integrity_check` before it replaces
+an older file of the same name, and again before it is restored.
+
+Usage:
+    python backup.py backup FILE [--db PATH] [--pages N] [--sleep SECONDS]
+    python backup.py restore FILE [--db PATH]
+    python backup.py check FILE
+"""
+import argparse
+import os
+import sqlite3
+import time
+from dataclasses import dataclass
+
+import database
+
+
+DB_FILEPATH = 'card.s3db'
+PAGES_PER_STEP = 1024
+SLEEP = 0.01
+
+
+@dataclass(frozen=True)
+class BackupReport:
+    """Size and duration of a finished copy."""
+
+    pages: int
+    page_size: int
+    elapsed: float
+
+    @property
+    def size(self):
+        return self.pages * self.page_size
+
+    @property
+    def mb_per_sec(self):
+        return self.size / 1e6 / self.elapsed if self.elapsed else 0.0
+
+
+class IntegrityError(Exception):
+    """A database file failed its integrity check."""
+
+
+def check_integrity(filepath):
+    """Run SQLite's integrity check on a database file.
+
+    Returns:
+        list: problems found, empty if the file is fine
+    """
+    if not os.path.exists(filepath):
+        return [f'{filepath} does not exist']
+
+    connection = sqlite3.connect(f'file:{filepath}?mode=ro', uri=True)
+    try:
+        rows = connection.execute('PRAGMA integrity_check;').fetchall()
+    except sqlite3.DatabaseError as e:
+        return [str(e)]
+    finally:
+        connection.close()
+
+    return [row[0] for row in rows if row[0] != 'ok']
+
+
+def _copy(source, target, pages, sleep, progress):
+    copied = 0
+
+    def on_step(status, remaining, total):
+        nonlocal copied
+        copied = total
+        if progress is not None:
+            progress(total - remaining, total)
+        # SQLite itself only sleeps while the database is busy or locked
+        if remaining and sleep:
+            time.sleep(sleep)
+
+    page_size = source.execute('PRAGMA page_size;').fetchone()[0]
+    start = time.perf_counter()
+    source.backup(target, pages=pages, progress=on_step, sleep=sleep)
+
+    return BackupReport(copied, page_size, time.perf_counter() - start)
+
+
+def backup(db_filepath, backup_filepath, pages=PAGES_PER_STEP, sleep=SLEEP,
+           progress=None):
+    """Copy a live database to a backup file.
+
+    The copy is written under a temporary name and only replaces an older
+    backup once it passed the integrity check.
+
+    Args:
+        db_filepath (str): database to be backed up
+        backup_filepath (str): backup file to be written
+        pages (int): pages copied per step, -1 copies all at once
+        sleep (float): seconds to pause between steps
+        progress (callable): optional callback receiving the numbers of
+            copied and total pages after every step
+
+    Returns:
+        BackupReport: size and duration of the copy
+
+    Raises:
+        FileNotFoundError: if the database doesn't exist
+        IntegrityError: if the copy is corrupt
+    """
+    if not os.path.exists(db_filepath):
+        raise FileNotFoundError(f'{db_filepath} does not exist')
+
+    temp_filepath = f'{backup_filepath}.tmp'
+    if os.path.exists(temp_filepath):
+        os.remove(temp_filepath)
+
+    # Read-only, so that a mistyped path can't create an empty database
+    source = sqlite3.connect(f'file:{db_filepath}?mode=ro', uri=True)
+    target = sqlite3.connect(temp_filepath)
+    try:
+        with database.read_snapshot(source):
+            # Backup steps reuse an open read transaction of the source
+            source.execute(database.COUNT_CARDS)
+            report = _copy(source, target, pages, sleep, progress)
+        # A single file is easier to move around than a WAL database
+        target.execute('PRAGMA journal_mode = DELETE;')
+    finally:
+        target.close()
+        source.close()
+
+    problems = check_integrity(temp_filepath)
+    if problems:
+        os.remove(temp_filepath)
+        raise IntegrityError('; '.join(problems))
+
+    os.replace(temp_filepath, backup_filepath)
+    return report
+
+
+def restore(backup_filepath, db_filepath, progress=None):
+    """Replace the contents of a database by a backup.
+
+    The database is overwritten in place, which keeps its journal mode
+    and is safe for readers, but connections of running servers keep
+    cached cards of the old contents: stop them first.
+
+    Raises:
+        IntegrityError: if the backup is corrupt, nothing is restored then
+    """
+    problems = check_integrity(backup_filepath)
+    if problems:
+        raise IntegrityError('; '.join(problems))
+
+    source = sqlite3.connect(f'file:{backup_filepath}?mode=ro', uri=True)
+    target = database.connect(db_filepath)
+    try:
+        return _copy(source, target, -1, 0, progress)
+    finally:
+        target.close()
+        source.close()
+
+
+def _print_progress(copied, total):
+    print(f'\r{copied:,} of {total:,} pages copied', end='', flush=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('command', choices=['backup', 'restore', 'check'])
+    parser.add_argument('file', help='backup file')
+    parser.add_argument('--db', default=DB_FILEPATH)
+    parser.add_argument('--pages', type=int, default=PAGES_PER_STEP,
+                        help='pages copied per step of a backup')
+    parser.add_argument('--sleep', type=float, default=SLEEP,
+                        help='seconds to pause between steps of a backup')
+    args = parser.parse_args()
+
+    if args.command == 'check':
+        problems = check_integrity(args.file)
+        for problem in problems:
+            print(problem)
+        print('Backup is corrupt.' if problems else 'Backup is fine.')
+        raise SystemExit(1 if problems else 0)
+
+    try:
+        if args.command == 'backup':
+            report = backup(args.db, args.file, args.pages, args.sleep,
+                            _print_progress)
+        else:
+            report = restore(args.file, args.db, _print_progress)
+    except FileNotFoundError as e:
+        print(e)
+        raise SystemExit(1)
+    except IntegrityError as e:
+        print(f'\nIntegrity check failed: {e}')
+        raise SystemExit(1)
+
+    print(f'\n{report.size / 1e6:,.1f} MB copied in {report.elapsed:.2f} s '
+          f'({report.mb_per_sec:,.1f} MB/s).')
+
+
+if __name__ == '__main__':
+    main()
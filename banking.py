@@ -1,7 +1,9 @@
-import math
 import random
 
 import database
+import luhn
+from bloom import BloomFilter
+from service import BankError, BankService, WrongCredentialsError
 
 
 DB_FILEPATH = 'card.s3db'
@@ -15,10 +17,37 @@ class BankingSystem:
     \r2. Log into account
     \r0. Exit"""
 
-    def __init__(self, db_filepath='database.s3db'):
-        """Initialize a banking system by connecting to database."""
-        self.connection = database.connect(db_filepath)
-        database.create_table(self.connection)
+    def __init__(self, db_filepath='database.s3db', card_filter=False):
+        """Initialize a banking system backed by a database file.
+
+        The database is connected to on first use.
+
+        Args:
+            db_filepath (str): path to database file
+            card_filter (bool): whether lookups of unknown card numbers
+                are answered by a Bloom filter; only safe while no other
+                process creates cards in the database
+        """
+        self.db_filepath = db_filepath
+        self.card_filter = card_filter
+        self._service = None
+
+    @property
+    def service(self):
+        """BankService connected to the system's database."""
+        if self._service is None:
+            connection = database.connect(self.db_filepath)
+            database.create_table(connection)
+            card_filter = None
+            if self.card_filter:
+                card_filter = BloomFilter.from_connection(connection)
+            self._service = BankService(connection, card_filter=card_filter)
+
+        return self._service
+
+    @property
+    def connection(self):
+        return self.service.connection
 
     def menu(self):
         """Show banking system's main menu."""
@@ -44,13 +73,11 @@ class BankingSystem:
 
     def create_account(self):
         """Create a new account and add it to the system's database."""
-        # Initialize a new Account object
-        account = Account.new()
+        card = self.service.create_account()
 
-        # Add the card to database
-        database.add_card(
-            self.connection, number=account.number, pin=account.pin
-        )
+        print('\nYour card has been created')
+        print(f'Your card number:\n{card.number}')
+        print(f'Your card PIN:\n{card.pin}')
 
     def login(self):
         """Log into an account."""
@@ -60,20 +87,17 @@ class BankingSystem:
         print('Enter your PIN:')
         pin_inp = input()
 
-        row = database.get_card_by_number(self.connection, card_num_inp)
-
         # Check credentials
-        if not row:
-            print('\nWrong card number or PIN!')
+        try:
+            card = self.service.login(card_num_inp, pin_inp)
+        except WrongCredentialsError as e:
+            print(f'\n{e}')
         else:
-            card_num, pin, balance = row[0]
-            if pin_inp != pin:
-                print('\nWrong card number or PIN!')
-            else:
-                print('\nYou have successfully logged in!')
+            print('\nYou have successfully logged in!')
 
-                account = Account(card_num, pin, balance, self.connection)
-                account.menu()
+            account = Account(card.number, card.pin, card.balance,
+                              self.connection, self.service)
+            account.menu()
 
 
 class Account:
@@ -89,26 +113,14 @@ class Account:
 
     __issuer_num = '400000'
 
-    def __init__(self, number, pin, balance, connection=None):
+    __slots__ = ('number', 'pin', 'balance', 'connection', 'service')
+
+    def __init__(self, number, pin, balance, connection=None, service=None):
         self.number = number
         self.pin = pin
         self.balance = balance
         self.connection = connection
-
-    @classmethod
-    def new(cls):
-        """Create a new account."""
-        account = cls(
-            number=cls._get_account_num(),
-            pin=cls._get_pin(),
-            balance=0
-        )
-
-        print('\nYour card has been created')
-        print(f'Your card number:\n{account.number}')
-        print(f'Your card PIN:\n{account.pin}')
-
-        return account
+        self.service = service or BankService(connection)
 
     @staticmethod
     def _get_account_num():
@@ -119,25 +131,8 @@ class Account:
         # Set Bank Identification Number and Account Identifier
         num = Account.__issuer_num + account_id
 
-        # Find checksum
-        new_num = []
-        for i, digit in enumerate(num, start=1):
-            if i % 2 == 1:
-                new_digit = int(digit) * 2
-                if new_digit > 9:
-                    new_digit -= 9
-                new_num.append(str(new_digit))
-            else:
-                new_num.append(digit)
-
-        sum_new_num = sum(map(int, new_num))
-
-        checksum = math.ceil(sum_new_num / 10)
-        checksum = checksum * 10 - sum_new_num
-
-        new_num = num + str(checksum)
-
-        return new_num
+        # Append checksum
+        return num + luhn.check_digit(num)
 
     @staticmethod
     def _get_pin():
@@ -161,14 +156,19 @@ class Account:
                 exit()
             elif action == '1':
                 # Show balance
+                self.balance = self.service.get_balance(self.number)
                 print(f'\nBalance: {self.balance}')
             elif action == '2':
                 # Get income
                 income = int(input('\nEnter income:\n'))
 
                 # Add income to the account
-                self.add_income(self.connection, income)
-                print('Income was added!')
+                try:
+                    self.add_income(self.connection, income)
+                except BankError as e:
+                    print(e)
+                else:
+                    print('Income was added!')
             elif action == '3':
                 print('\nTransfer')
 
@@ -193,8 +193,11 @@ class Account:
             connection (obj): database connection handle
             income (int): money to be added to the current balance
         """
-        database.add_income(connection, self.number, income)
-        self.balance += income
+        service = self.service
+        if connection is not self.connection:
+            service = BankService(connection)
+
+        self.balance = service.add_income(self.number, income)
 
     def transfer_money(self, receiver):
         """Transfer money to another account.
@@ -208,67 +211,56 @@ class Account:
         Args:
             receiver (str): receiver's bank account number
         """
-        if receiver == self.number:
-            print('You can\'t transfer money to the same account!')
-        elif not is_card_number_valid(receiver):
-            print('Probably you made a mistake in the card number. '
-                  'Please try again!')
-        elif not do_card_number_exists(self.connection, receiver):
-            print('Such a card does not exist.')
+        try:
+            self.service.check_receiver(self.number, receiver)
+        except BankError as e:
+            print(e)
+            return
+
+        # Get the amount of money to be transferred
+        amount = int(input('\nEnter how much money you want to transfer:\n'))
+
+        # Move the money if such amount is available
+        try:
+            transfer = self.service.transfer_money(
+                self.number, receiver, amount
+            )
+        except BankError as e:
+            print(e)
         else:
-            # Get the amount of money to be transferred
-            amount = int(input('\nEnter how much money you want to transfer:\n'))
-
-            # Check if such amount is available
-            if amount <= self.balance:
-                # Delete amount from user account
-                database.add_income(self.connection, self.number, -amount)
-                self.balance -= amount
-
-                # Add amount to the receiver account
-                database.add_income(self.connection, receiver, amount)
-
-                print('Success!')
-            else:
-                print('Not enough money!')
+            self.balance = transfer.balance
+            print('Success!')
 
     def delete_account(self):
         """Delete the account from the database."""
-        database.delete_card(self.connection, self.number)
+        self.service.delete_account(self.number)
 
 
 def is_card_number_valid(number):
     """Check that the card number passes Luhn algorithm."""
-    new_number = []
-    for i, digit in enumerate(number[:-1], start=1):
-        if i % 2 == 1:
-            new_digit = int(digit) * 2
-            if new_digit > 9:
-                new_digit -= 9
-            new_number.append(str(new_digit))
-        else:
-            new_number.append(digit)
+    return luhn.is_valid(number)
 
-    sum_new_number = sum(map(int, new_number))
-    total = sum_new_number + int(number[-1])
 
-    return True if total % 10 == 0 else False
-
-
-def do_card_number_exists(connection, number):
+def do_card_number_exists(connection, number, card_filter=None):
     """Check that the card number exists in a database.
 
     Args:
         connection (obj): Connection object
         number (str): card number to be checked
+        card_filter (BloomFilter): optional filter of existing card numbers
+            answering definite misses without a query
 
     Returns:
         bool: True if card number exists in the database, False otherwise
     """
-    result = database.get_card_by_number(connection, number)
+    return BankService(connection, card_filter=card_filter).card_exists(number)
+
 
-    return False if result == [] else True
+def main():
+    """Run the interactive banking system."""
+    banking_system = BankingSystem(DB_FILEPATH)
+    banking_system.menu()
 
 
-banking_system = BankingSystem(DB_FILEPATH)
-banking_system.menu()
\ No newline at end of file
+if __name__ == '__main__':
+    main()
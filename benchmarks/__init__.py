@@ -0,0 +1,3 @@
+"""
+Benchmarks of the banking system, run with `python -m benchmarks.<name>`.
+"""
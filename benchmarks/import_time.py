@@ -0,0 +1,51 @@
+"""
+Measure the cold-start cost of importing the banking modules.
+
+Every module is imported in a fresh interpreter, so the numbers include
+loading its dependencies. The cost of starting an empty interpreter is
+subtracted.
+
+Usage:
+    python -m benchmarks.import_time [--repeat R] [module ...]
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+
+MODULES = ['luhn', 'database', 'issuance', 'service', 'banking']
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def time_import(statement, repeat):
+    """Return the median wall time of running `statement` in a new process."""
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, '-c', statement], cwd=ROOT,
+                       check=True, stdin=subprocess.DEVNULL)
+        timings.append(time.perf_counter() - start)
+
+    return statistics.median(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('modules', nargs='*', default=MODULES)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    baseline = time_import('pass', args.repeat)
+    print(f'Empty interpreter: {baseline * 1000:.1f} ms '
+          f'(median of {args.repeat})')
+
+    for module in args.modules:
+        elapsed = time_import(f'import {module}', args.repeat) - baseline
+        print(f'import {module:<12}{elapsed * 1000:>8.1f} ms')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,248 @@
+"""
+Closed-loop load generator simulating customer traffic.
+
+Every virtual user is a thread issuing one BankService operation after
+another, with no think time, for the given duration. Operations are drawn
+from a configurable mix and hit accounts with Zipf-skewed popularity, so
+a few hot accounts see most of the traffic.
+
+Usage:
+    python -m benchmarks.loadgen [--db PATH] [--accounts N] [--users N]
+                                 [--duration SECONDS] [--zipf S]
+                                 [--mix balance=70,transfer=20,...]
+                                 [--locks]
+"""
+import argparse
+import itertools
+import json
+import os
+import random
+import sqlite3
+import tempfile
+import threading
+import time
+from collections import Counter, defaultdict
+
+import database
+import issuance
+from locks import LockManager
+from service import BankError, BankService
+
+
+DEFAULT_MIX = 'balance=70,transfer=20,deposit=5,create=2.5,close=2.5'
+
+# Latency histogram buckets: upper bounds in microseconds, doubling
+BUCKETS = [2 ** i for i in range(4, 24)]
+
+
+def parse_mix(text):
+    """Parse `name=weight,...` into a dict of operation weights."""
+    mix = {}
+    for part in text.split(','):
+        name, weight = part.split('=')
+        mix[name.strip()] = float(weight)
+
+    unknown = set(mix) - set(VirtualUser.OPERATIONS)
+    if unknown:
+        raise ValueError(f'Unknown operations: {", ".join(sorted(unknown))}')
+    return mix
+
+
+def zipf_cum_weights(count, exponent):
+    """Cumulative Zipf weights for ranks 1..count."""
+    return list(itertools.accumulate(
+        1 / rank ** exponent for rank in range(1, count + 1)
+    ))
+
+
+class Recorder:
+    """Collects latencies and outcomes of all virtual users."""
+
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.outcomes = defaultdict(Counter)
+        self._lock = threading.Lock()
+
+    def record(self, operation, latency, outcome):
+        with self._lock:
+            self.latencies[operation].append(latency)
+            self.outcomes[operation][outcome] += 1
+
+
+class VirtualUser(threading.Thread):
+    """Thread running operations back to back until the deadline."""
+
+    OPERATIONS = ('balance', 'transfer', 'deposit', 'create', 'close')
+
+    def __init__(self, pool, numbers, cum_weights, mix, deadline, recorder,
+                 seed, locks=None):
+        super().__init__(daemon=True)
+        self.pool = pool
+        self.numbers = numbers
+        self.cum_weights = cum_weights
+        self.operation_names = list(mix)
+        self.operation_weights = list(mix.values())
+        self.deadline = deadline
+        self.recorder = recorder
+        self.random = random.Random(seed)
+        self.locks = locks
+        self.created = []
+
+    def pick_account(self):
+        return self.random.choices(self.numbers,
+                                   cum_weights=self.cum_weights)[0]
+
+    def balance(self, service):
+        service.get_balance(self.pick_account())
+
+    def transfer(self, service):
+        sender, receiver = self.pick_account(), self.pick_account()
+        service.transfer_money(sender, receiver, self.random.randint(1, 100))
+
+    def deposit(self, service):
+        service.add_income(self.pick_account(), self.random.randint(1, 1000))
+
+    def create(self, service):
+        self.created.append(service.create_account().number)
+
+    def close(self, service):
+        # Only close accounts this user created, the hot set stays intact
+        if self.created:
+            service.delete_account(self.created.pop())
+        else:
+            self.create(service)
+
+    def run(self):
+        with self.pool.connection() as connection:
+            service = BankService(connection, locks=self.locks)
+            while time.perf_counter() < self.deadline:
+                name, = self.random.choices(self.operation_names,
+                                            self.operation_weights)
+                start = time.perf_counter()
+                try:
+                    getattr(self, name)(service)
+                    outcome = 'ok'
+                except BankError as e:
+                    outcome = type(e).__name__
+                except sqlite3.OperationalError as e:
+                    outcome = f'OperationalError: {e}'
+                self.recorder.record(name, time.perf_counter() - start,
+                                     outcome)
+
+
+def histogram(latencies):
+    """Count latencies per bucket of BUCKETS."""
+    counts = Counter()
+    for latency in latencies:
+        micros = latency * 1e6
+        bucket = next((b for b in BUCKETS if micros <= b), float('inf'))
+        counts[bucket] += 1
+    return counts
+
+
+def summarize(recorder, elapsed):
+    """Build the report of a run."""
+    report = {'elapsed': round(elapsed, 3), 'operations': {}}
+    total = 0
+    for name, latencies in sorted(recorder.latencies.items()):
+        latencies.sort()
+        count = len(latencies)
+        total += count
+        report['operations'][name] = {
+            'count': count,
+            'ops_per_sec': round(count / elapsed, 1),
+            'p50_ms': round(latencies[count // 2] * 1000, 3),
+            'p95_ms': round(latencies[int(count * 0.95)] * 1000, 3),
+            'p99_ms': round(latencies[int(count * 0.99)] * 1000, 3),
+            'max_ms': round(latencies[-1] * 1000, 3),
+            'outcomes': dict(recorder.outcomes[name]),
+            'histogram_us': {
+                str(bucket): hits
+                for bucket, hits in sorted(histogram(latencies).items())
+            },
+        }
+
+    report['ops_per_sec'] = round(total / elapsed, 1)
+    report['lock_errors'] = sum(
+        hits
+        for outcomes in recorder.outcomes.values()
+        for outcome, hits in outcomes.items()
+        if outcome.startswith('OperationalError')
+    )
+    return report
+
+
+def print_report(report):
+    print(f'\nThroughput: {report["ops_per_sec"]:,.0f} ops/s '
+          f'over {report["elapsed"]:.1f} s, '
+          f'lock errors: {report["lock_errors"]}')
+    for name, stats in report['operations'].items():
+        print(f'\n{name}: {stats["count"]:,} ops, '
+              f'{stats["ops_per_sec"]:,.0f} ops/s, '
+              f'p50 {stats["p50_ms"]} ms, p95 {stats["p95_ms"]} ms, '
+              f'p99 {stats["p99_ms"]} ms, max {stats["max_ms"]} ms')
+        print(f'  outcomes: {stats["outcomes"]}')
+
+        peak = max(stats['histogram_us'].values())
+        for bucket, hits in stats['histogram_us'].items():
+            bar = '#' * max(1, round(40 * hits / peak))
+            print(f'  <= {bucket:>9} us {hits:>9,} {bar}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--db', help='database to load, default: a '
+                                     'temporary one filled with --accounts')
+    parser.add_argument('--accounts', type=int, default=10_000)
+    parser.add_argument('--users', type=int, default=16)
+    parser.add_argument('--duration', type=float, default=10)
+    parser.add_argument('--zipf', type=float, default=1.1,
+                        help='Zipf exponent of account popularity')
+    parser.add_argument('--mix', type=parse_mix, default=DEFAULT_MIX)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--locks', action='store_true',
+                        help='share per-account locks between users')
+    parser.add_argument('--output', help='write the report as JSON')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_filepath = args.db or os.path.join(tmp, 'load.s3db')
+        pool = database.ConnectionPool(db_filepath)
+        with pool.connection() as connection:
+            database.create_table(connection)
+            if args.db is None:
+                issuance.issue_cards(connection, args.accounts,
+                                     plaintext_pins=True)
+                with connection as c:
+                    c.execute('UPDATE card SET balance = 1000000;')
+            numbers = [row[0] for row in database.iter_cards(connection)]
+
+        rng = random.Random(args.seed)
+        rng.shuffle(numbers)
+        cum_weights = zipf_cum_weights(len(numbers), args.zipf)
+
+        locks = LockManager() if args.locks else None
+        recorder = Recorder()
+        start = time.perf_counter()
+        users = [
+            VirtualUser(pool, numbers, cum_weights, args.mix,
+                        start + args.duration, recorder, args.seed + i,
+                        locks)
+            for i in range(args.users)
+        ]
+        for user in users:
+            user.start()
+        for user in users:
+            user.join()
+        elapsed = time.perf_counter() - start
+        pool.close()
+
+    report = summarize(recorder, elapsed)
+    print_report(report)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
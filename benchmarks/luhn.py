@@ -0,0 +1,68 @@
+"""
+Compare scalar and batch Luhn validation.
+
+Usage:
+    python -m benchmarks.luhn [--count N] [--repeat R]
+"""
+import argparse
+import random
+import timeit
+
+import luhn
+
+
+def legacy_is_valid(number):
+    """Original string-list implementation, kept as a reference."""
+    new_number = []
+    for i, digit in enumerate(number[:-1], start=1):
+        if i % 2 == 1:
+            new_digit = int(digit) * 2
+            if new_digit > 9:
+                new_digit -= 9
+            new_number.append(str(new_digit))
+        else:
+            new_number.append(digit)
+
+    total = sum(map(int, new_number)) + int(number[-1])
+
+    return total % 10 == 0
+
+
+def random_numbers(count):
+    """Generate card numbers, roughly half of them valid."""
+    partials = [f'400000{random.randrange(10 ** 9):09d}' for _ in range(count)]
+    numbers = luhn.complete_batch(partials)
+    return [
+        number if random.random() < 0.5
+        else number[:-1] + str(random.randrange(10))
+        for number in numbers
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--count', type=int, default=500_000)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    numbers = random_numbers(args.count)
+
+    expected = [legacy_is_valid(number) for number in numbers]
+    assert [luhn.is_valid(number) for number in numbers] == expected
+    assert luhn.validate_batch(numbers) == expected
+
+    candidates = {
+        'legacy loop': lambda: [legacy_is_valid(n) for n in numbers],
+        'luhn.is_valid loop': lambda: [luhn.is_valid(n) for n in numbers],
+        'luhn.validate_batch': lambda: luhn.validate_batch(numbers),
+    }
+
+    print(f'Validating {args.count:,} card numbers (best of {args.repeat})')
+    for name, func in candidates.items():
+        best = min(timeit.repeat(func, number=1, repeat=args.repeat))
+        print(f'{name:<22}{best * 1000:>10.1f} ms'
+              f'{args.count / best:>14,.0f} numbers/s')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,190 @@
+"""
+Benchmark every banking operation at several table sizes.
+
+Each table size gets a fresh temporary database filled with issued cards.
+Every operation is timed call by call; ops/sec and p50/p95/p99 latencies
+are written to a JSON file which can be compared against a baseline.
+
+Usage:
+    python -m benchmarks.suite [--sizes 1000 100000] [--output FILE]
+                               [--baseline FILE] [--tolerance 0.2]
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+
+import database
+import issuance
+from banking import Account, is_card_number_valid
+from service import BankService
+
+
+DEFAULT_SIZES = [1_000, 10_000, 100_000]
+
+
+def percentile(sorted_values, fraction):
+    index = min(len(sorted_values) - 1, int(len(sorted_values) * fraction))
+    return sorted_values[index]
+
+
+def measure(func, args_list):
+    """Call `func` once per argument tuple and summarize the latencies."""
+    timings = []
+    perf_counter_ns = time.perf_counter_ns
+    for args in args_list:
+        start = perf_counter_ns()
+        func(*args)
+        timings.append(perf_counter_ns() - start)
+
+    timings.sort()
+    total = sum(timings) / 1e9
+    return {
+        'count': len(timings),
+        'ops_per_sec': round(len(timings) / total, 1),
+        'p50_us': round(percentile(timings, 0.50) / 1000, 2),
+        'p95_us': round(percentile(timings, 0.95) / 1000, 2),
+        'p99_us': round(percentile(timings, 0.99) / 1000, 2),
+    }
+
+
+def run_size(size, ops, wal):
+    """Benchmark all operations against a table of `size` cards."""
+    with tempfile.TemporaryDirectory() as tmp:
+        db_filepath = os.path.join(tmp, 'bench.s3db')
+        if wal:
+            pool = database.ConnectionPool(db_filepath)
+            with pool.connection() as connection:
+                results = run_operations(connection, size, ops)
+            pool.close()
+        else:
+            connection = database.connect(db_filepath)
+            results = run_operations(connection, size, ops)
+            connection.close()
+
+    return results
+
+
+def run_operations(connection, size, ops):
+    """Fill the database with `size` cards and time every operation."""
+    database.create_table(connection)
+    numbers = [n for n, _ in issuance.issue_cards(connection, size,
+                                                  plaintext_pins=True)]
+    with connection as c:
+        c.execute('UPDATE card SET balance = 1000000;')
+
+    service = BankService(connection)
+    new_numbers = issuance.allocate_numbers(connection, ops)
+    lookups = [(connection, random.choice(numbers)) for _ in range(ops)]
+    pairs = [random.sample(numbers, 2) for _ in range(ops)]
+
+    return {
+        'Account._get_account_num': measure(
+            Account._get_account_num, [()] * ops * 10
+        ),
+        'is_card_number_valid': measure(
+            is_card_number_valid,
+            [(random.choice(numbers),) for _ in range(ops * 10)]
+        ),
+        'database.add_card': measure(
+            database.add_card,
+            [(connection, number, '0000') for number in new_numbers]
+        ),
+        'database.get_card_by_number': measure(
+            database.get_card_by_number, lookups
+        ),
+        'database.add_income': measure(
+            database.add_income,
+            [(connection, number, 1) for _, number in lookups]
+        ),
+        'BankService.transfer_money': measure(
+            service.transfer_money,
+            [(sender, receiver, 1) for sender, receiver in pairs]
+        ),
+        'database.delete_card': measure(
+            database.delete_card,
+            [(connection, number) for number in new_numbers]
+        ),
+    }
+
+
+def compare(results, baseline, tolerance):
+    """Find operations whose throughput dropped below the baseline.
+
+    Returns:
+        list: descriptions of the regressions
+    """
+    regressions = []
+    for size, operations in results['results'].items():
+        for name, stats in operations.items():
+            before = baseline['results'].get(size, {}).get(name)
+            if before is None:
+                continue
+
+            ratio = stats['ops_per_sec'] / before['ops_per_sec']
+            if ratio < 1 - tolerance:
+                regressions.append(
+                    f'{name} @ {size} rows: {before["ops_per_sec"]:,.0f} -> '
+                    f'{stats["ops_per_sec"]:,.0f} ops/s ({ratio - 1:+.0%})'
+                )
+
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES)
+    parser.add_argument('--ops', type=int, default=2000,
+                        help='timed calls per database operation')
+    parser.add_argument('--wal', action='store_true',
+                        help='use ConnectionPool pragmas (WAL)')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default='bench_results.json')
+    parser.add_argument('--baseline', help='JSON file from an earlier run')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='allowed relative drop of ops/sec')
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    results = {
+        'meta': {
+            'python': platform.python_version(),
+            'sqlite': sqlite3.sqlite_version,
+            'platform': platform.platform(),
+            'ops': args.ops,
+            'wal': args.wal,
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        },
+        'results': {},
+    }
+
+    for size in args.sizes:
+        print(f'\n{size:,} rows')
+        operations = run_size(size, args.ops, args.wal)
+        results['results'][str(size)] = operations
+        for name, stats in operations.items():
+            print(f'  {name:<30}{stats["ops_per_sec"]:>12,.0f} ops/s'
+                  f'  p50 {stats["p50_us"]:>8.1f} us'
+                  f'  p99 {stats["p99_us"]:>8.1f} us')
+
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f'\nResults written to {args.output}')
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+
+        for regression in regressions:
+            print(f'REGRESSION {regression}')
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,129 @@
+"""
+Bloom filter answering "definitely not a card number" without the database.
+"""
+import hashlib
+import math
+import threading
+
+import database
+
+
+class BloomFilter:
+    """Probabilistic set of strings with no false negatives.
+
+    Items can't be removed from a Bloom filter. Deleted items are only
+    counted: they keep answering "maybe", which costs a database lookup but
+    is never wrong. `needs_rebuild` tells when enough of them piled up, or
+    the filter is over capacity, and `rebuild` starts it afresh.
+
+    A filter only knows the items added to it: it answers wrong "no"s for
+    cards created by other processes, so it may only be used while all
+    cards are created through services sharing it.
+    """
+
+    def __init__(self, capacity, error_rate=0.01):
+        """Initialize an empty filter.
+
+        Args:
+            capacity (int): expected number of items
+            error_rate (float): false positive rate at full capacity
+        """
+        capacity = max(capacity, 1)
+        self.capacity = capacity
+        self.error_rate = error_rate
+        size = math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2)
+        hash_count = max(1, round(size / capacity * math.log(2)))
+        # Replaced as a whole by a rebuild, lookups read it only once
+        self._table = (size, hash_count, bytearray((size + 7) // 8))
+        self.count = 0
+        self.deleted = 0
+        self._added = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_connection(cls, connection, error_rate=0.01, headroom=2):
+        """Build a filter of all card numbers in the database.
+
+        Args:
+            connection (obj): Connection object
+            error_rate (float): false positive rate at full capacity
+            headroom (float): capacity relative to the current card count
+        """
+        count = database.count_cards(connection)
+        bloom = cls(int(count * headroom) + 1000, error_rate)
+        bloom.update(row[0] for row in database.iter_cards(connection))
+
+        return bloom
+
+    @staticmethod
+    def _positions(item, size, hash_count):
+        digest = hashlib.blake2b(item.encode(), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], 'little')
+        second = int.from_bytes(digest[8:], 'little') | 1
+
+        return [(first + i * second) % size for i in range(hash_count)]
+
+    def add(self, item):
+        with self._lock:
+            size, hash_count, bits = self._table
+            for position in self._positions(item, size, hash_count):
+                bits[position >> 3] |= 1 << (position & 7)
+            self.count += 1
+            if self._added is not None:
+                self._added.append(item)
+
+    def update(self, items):
+        for item in items:
+            self.add(item)
+
+    def discard(self, item):
+        """Record that an item was deleted from the underlying set."""
+        with self._lock:
+            self.deleted += 1
+
+    def __contains__(self, item):
+        size, hash_count, bits = self._table
+        return all(bits[position >> 3] & 1 << (position & 7)
+                   for position in self._positions(item, size, hash_count))
+
+    def needs_rebuild(self):
+        """Check whether the filter is over capacity or full of deletions."""
+        return (self.count > self.capacity
+                or self.deleted > self.count // 4)
+
+    def rebuild(self, connection, headroom=2):
+        """Refill the filter in place from all card numbers in the database.
+
+        Lookups keep using the old bits until the new ones are complete,
+        and items added meanwhile are carried over, so no card created
+        through services sharing the filter is ever missed.
+
+        Args:
+            connection (obj): Connection object
+            headroom (float): capacity relative to the current card count
+
+        Returns:
+            bool: False if another thread is rebuilding the filter already
+        """
+        with self._lock:
+            if self._added is not None:
+                return False
+            self._added = []
+
+        try:
+            fresh = BloomFilter.from_connection(connection, self.error_rate,
+                                                headroom)
+        except BaseException:
+            with self._lock:
+                self._added = None
+            raise
+
+        with self._lock:
+            fresh.update(self._added)
+            self._added = None
+            self.capacity = fresh.capacity
+            self._table = fresh._table
+            self.count = fresh.count
+            self.deleted = 0
+
+        return True
@@ -0,0 +1,103 @@
+"""
+Thread-safe in-process LRU cache with optional expiry.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+
+_MISSING = object()
+
+
+class LRUCache:
+    """Bounded mapping that evicts the least recently used entries.
+
+    Loaders that race with writers use `epoch()` and `put(..., epoch=)`:
+    a value loaded before an invalidation is dropped instead of cached,
+    so an entry can never become older than the last invalidation.
+    """
+
+    def __init__(self, maxsize=10000, ttl=None, clock=time.monotonic):
+        """Initialize an empty cache.
+
+        Args:
+            maxsize (int): maximum number of entries
+            ttl (float): seconds after which an entry expires, None to keep
+                entries until they are evicted or invalidated
+            clock (callable): time source used for expiry
+        """
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._data = OrderedDict()
+        self._epoch = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def epoch(self):
+        """Return a token to be passed to `put` by a loader."""
+        return self._epoch
+
+    def get(self, key, default=None):
+        """Return a cached value and mark it as recently used."""
+        with self._lock:
+            value, expires = self._data.get(key, (_MISSING, None))
+            if expires is not None and expires <= self.clock():
+                del self._data[key]
+                value = _MISSING
+
+            if value is _MISSING:
+                self.misses += 1
+                return default
+
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value, epoch=None):
+        """Cache a value.
+
+        Args:
+            key: cache key
+            value: value to be cached
+            epoch (int): result of `epoch()` taken before the value was
+                loaded; the value is dropped if anything was invalidated
+                since then
+        """
+        expires = None if self.ttl is None else self.clock() + self.ttl
+        with self._lock:
+            if epoch is not None and epoch != self._epoch:
+                return
+
+            self._data[key] = (value, expires)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, *keys):
+        """Remove entries, e.g. after their source data has changed."""
+        with self._lock:
+            self._epoch += 1
+            for key in keys:
+                self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._epoch += 1
+            self._data.clear()
+
+    def stats(self):
+        """Return hit/miss counters and the current size."""
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'size': len(self._data),
+            'maxsize': self.maxsize,
+        }
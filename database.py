@@ -1,79 +1,901 @@
-"""
-Code for interacting with a database.
-"""
-import sqlite3
-from sqlite3 import Error
-
-
-CREATE_TABLE = '''
-CREATE TABLE IF NOT EXISTS card (
-    id INTEGER NOT NULL PRIMARY KEY AUTOINCREMENT,
-    number TEXT NOT NULL UNIQUE,
-    pin TEXT NOT NULL,
-    balance INTEGER DEFAULT 0 NOT NULL
-);'''
-
-INSERT_CARD = 'INSERT INTO card (number, pin) VALUES (?, ?);'
-
-GET_CARD_BY_NUMBER = 'SELECT number, pin, balance FROM card WHERE number = ?;'
-GET_ALL_CARDS = 'SELECT number, pin, balance FROM card;'
-
-ADD_INCOME = 'UPDATE card SET balance = balance + ? WHERE number = ?;'
-
-DELETE_CARD = 'DELETE FROM card WHERE number = ?';
-
-
-def connect(db_filepath):
-    """Set a database connection to the SQLite database.
-
-    Args:
-        db_filepath (str): path to database file
-
-    Returns:
-        obj: Connection object or None
-    """
-    try:
-        connection = sqlite3.connect(db_filepath)
-    except Error as e:
-        print(e)
-        connection = None
-
-    return connection
-
-
-def create_table(connection):
-    with connection as c:
-        c.execute(CREATE_TABLE)
-
-
-def add_card(connection, number, pin):
-    with connection as c:
-        c.execute(INSERT_CARD, (number, pin))
-
-
-def get_card_by_number(connection, number):
-    with connection as c:
-        return c.execute(GET_CARD_BY_NUMBER, (number,)).fetchall()
-
-
-def get_all_cards(connection):
-    with connection as c:
-        return c.execute(GET_ALL_CARDS).fetchall()
-
-
-def add_income(connection, number, income):
-    """Add money to the account's current balance.
-
-    Arguments:
-        connection (obj): Connection object
-        number (str): account number
-        income (int): money to be added to the current account's balance
-    """
-    with connection as c:
-        c.execute(ADD_INCOME, (income, number))
-
-
-def delete_card(connection, number):
-    """Delete card entity from the database."""
-    with connection as c:
-        c.execute(DELETE_CARD, (number,))
+"""
+Code for interacting with a database.
+"""
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from sqlite3 import Error
+
+
+CREATE_TABLE = '''
+CREATE TABLE IF NOT EXISTS card (
+    id INTEGER NOT NULL PRIMARY KEY AUTOINCREMENT,
+    number TEXT NOT NULL UNIQUE,
+    pin TEXT NOT NULL,
+    balance INTEGER DEFAULT 0 NOT NULL
+);'''
+
+# Optional schema storing card numbers as 64-bit integers, which makes the
+# UNIQUE index about half the size. Numbers are still passed as strings:
+# INTEGER affinity converts them on insert and in comparisons, and every
+# query reading numbers casts them back to TEXT.
+CREATE_INTEGER_TABLE = '''
+CREATE TABLE IF NOT EXISTS {} (
+    id INTEGER NOT NULL PRIMARY KEY AUTOINCREMENT,
+    number INTEGER NOT NULL UNIQUE,
+    pin TEXT NOT NULL,
+    balance INTEGER DEFAULT 0 NOT NULL
+);'''
+GET_NUMBER_TYPE = '''
+SELECT type FROM pragma_table_info('card') WHERE name = 'number';'''
+COUNT_NON_INTEGER_NUMBERS = '''
+SELECT COUNT(*) FROM card
+WHERE number GLOB '*[^0-9]*' OR number GLOB '0*' OR length(number) > 18;'''
+COPY_TO_INTEGER_TABLE = '''
+INSERT INTO card_new (id, number, pin, balance)
+SELECT id, CAST(number AS INTEGER), pin, balance FROM card ORDER BY id;'''
+REPLACE_CARD_TABLE = (
+    'DROP TABLE card;',
+    'ALTER TABLE card_new RENAME TO card;',
+)
+# The copy only carries the highest id over, ids of cards deleted since
+# then mustn't be handed out again
+GET_CARD_SEQUENCE = '''
+SELECT seq FROM sqlite_sequence WHERE name = 'card';'''
+SET_CARD_SEQUENCE = (
+    "DELETE FROM sqlite_sequence WHERE name = 'card';",
+    "INSERT INTO sqlite_sequence (name, seq) VALUES ('card', ?);",
+)
+
+CREATE_ISSUER_TABLE = '''
+CREATE TABLE IF NOT EXISTS issuer (
+    issuer_num TEXT NOT NULL PRIMARY KEY,
+    key INTEGER NOT NULL,
+    next_index INTEGER DEFAULT 0 NOT NULL
+);'''
+
+CREATE_LEDGER_TABLE = '''
+CREATE TABLE ledger (
+    id INTEGER NOT NULL PRIMARY KEY,
+    account TEXT NOT NULL,
+    counterparty TEXT,
+    amount INTEGER NOT NULL,
+    kind TEXT NOT NULL,
+    created_at TEXT DEFAULT (strftime('%Y-%m-%d %H:%M:%f', 'now')) NOT NULL
+);'''
+CREATE_LEDGER_INDEX = '''
+CREATE INDEX IF NOT EXISTS ledger_account ON ledger (account);'''
+CREATE_LEDGER_TRIGGERS = (
+    '''
+    CREATE TRIGGER IF NOT EXISTS ledger_no_update BEFORE UPDATE ON ledger
+    BEGIN SELECT RAISE(ABORT, 'ledger is append-only'); END;''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS ledger_no_delete BEFORE DELETE ON ledger
+    BEGIN SELECT RAISE(ABORT, 'ledger is append-only'); END;''',
+)
+# Results of deposits and transfers by client-chosen key, saved in the
+# transaction applying the operation so a retry can never apply it twice.
+# BankService prefixes keys with the client's account number.
+CREATE_IDEMPOTENCY_TABLE = '''
+CREATE TABLE IF NOT EXISTS idempotency_key (
+    key TEXT NOT NULL PRIMARY KEY,
+    request TEXT NOT NULL,
+    balance INTEGER NOT NULL,
+    created_at TEXT DEFAULT (strftime('%Y-%m-%d %H:%M:%f', 'now')) NOT NULL
+) WITHOUT ROWID;'''
+
+HAS_LEDGER_TABLE = '''
+SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'ledger';'''
+# Existing balances become opening entries when the ledger is introduced
+OPEN_LEDGER = '''
+INSERT INTO ledger (account, amount, kind)
+SELECT number, balance, 'opening' FROM card WHERE balance != 0;'''
+
+INSERT_CARD = 'INSERT INTO card (number, pin) VALUES (?, ?);'
+
+GET_CARD_BY_NUMBER = '''
+SELECT CAST(number AS TEXT), pin, balance FROM card WHERE number = ?;'''
+GET_BALANCE = 'SELECT balance FROM card WHERE number = ?;'
+GET_ALL_CARDS = 'SELECT CAST(number AS TEXT), pin, balance FROM card;'
+GET_CARDS_PAGE = '''
+SELECT id, CAST(number AS TEXT), pin, balance FROM card
+WHERE id > ? ORDER BY id LIMIT ?;'''
+COUNT_CARDS = 'SELECT COUNT(*) FROM card;'
+GET_EXISTING_NUMBERS = '''
+SELECT CAST(number AS TEXT) FROM card WHERE number IN ({});'''
+
+INSERT_ISSUER = 'INSERT OR IGNORE INTO issuer (issuer_num, key) VALUES (?, ?);'
+RESERVE_ACCOUNT_IDS = '''
+UPDATE issuer SET next_index = next_index + ? WHERE issuer_num = ?;'''
+GET_ISSUER = 'SELECT key, next_index FROM issuer WHERE issuer_num = ?;'
+
+# Credits beyond the largest INTEGER would silently turn balances into REAL
+MAX_BALANCE = 2 ** 63 - 1
+ADD_INCOME = f'''
+UPDATE card SET balance = balance + ?
+WHERE number = ? AND balance <= {MAX_BALANCE} - ?;'''
+WITHDRAW = '''
+UPDATE card SET balance = balance - ?
+WHERE number = ? AND balance >= ? AND ? > 0;'''
+
+INSERT_DEPOSIT = '''
+INSERT INTO ledger (account, amount, kind) VALUES (?, ?, 'deposit');'''
+INSERT_TRANSFER = '''
+INSERT INTO ledger (account, counterparty, amount, kind)
+VALUES (?, ?, ?, 'transfer'), (?, ?, ?, 'transfer');'''
+GET_HISTORY = '''
+SELECT id, account, counterparty, amount, kind, created_at FROM ledger
+WHERE account = ? AND id < ? ORDER BY id DESC LIMIT ?;'''
+REBUILD_BALANCES = '''
+UPDATE card SET balance = totals.total
+FROM (SELECT account, SUM(amount) AS total FROM ledger GROUP BY account)
+    AS totals
+WHERE card.number = totals.account AND card.balance != totals.total;'''
+CLEAR_UNBOOKED_BALANCES = '''
+UPDATE card SET balance = 0
+WHERE balance != 0 AND number NOT IN (SELECT account FROM ledger);'''
+
+GET_IDEMPOTENT_RESULT = '''
+SELECT request, balance FROM idempotency_key WHERE key = ?;'''
+INSERT_IDEMPOTENT_RESULT = '''
+INSERT INTO idempotency_key (key, request, balance) VALUES (?, ?, ?);'''
+
+BEGIN = 'BEGIN;'
+SAVEPOINT = 'SAVEPOINT {};'
+ROLLBACK_TO = 'ROLLBACK TO {};'
+RELEASE = 'RELEASE {};'
+BEGIN_IMMEDIATE = 'BEGIN IMMEDIATE;'
+
+# Bulk imports are staged in an unindexed temporary table first. Accepted
+# rows reach `card` sorted by number, which fills its UNIQUE index in
+# order instead of at random places
+CREATE_IMPORT_TABLE = '''
+CREATE TEMP TABLE IF NOT EXISTS card_import (
+    line INTEGER NOT NULL PRIMARY KEY,
+    number TEXT NOT NULL,
+    pin TEXT NOT NULL,
+    balance INTEGER NOT NULL,
+    rejected TEXT
+);'''
+CLEAR_IMPORT_TABLE = 'DELETE FROM card_import;'
+INSERT_IMPORT = '''
+INSERT INTO card_import (line, number, pin, balance) VALUES (?, ?, ?, ?);'''
+REJECT_IMPORT_EXISTING = '''
+UPDATE card_import SET rejected = 'card exists'
+WHERE number IN (SELECT number FROM card);'''
+INSERT_IMPORTED_CARDS = '''
+INSERT INTO card (number, pin, balance)
+SELECT number, pin, balance FROM card_import
+WHERE rejected IS NULL ORDER BY number;'''
+OPEN_IMPORTED_LEDGER = '''
+INSERT INTO ledger (account, amount, kind)
+SELECT number, balance, 'opening' FROM card_import
+WHERE rejected IS NULL AND balance != 0 ORDER BY number;'''
+GET_IMPORT_REJECTS = '''
+SELECT line, number, rejected FROM card_import
+WHERE rejected IS NOT NULL ORDER BY line;'''
+
+UPDATE_PIN = 'UPDATE card SET pin = ? WHERE id = ? AND pin = ?;'
+
+# The remaining balance leaves the books when an account is closed
+CLOSE_LEDGER = '''
+INSERT INTO ledger (account, amount, kind)
+SELECT number, -balance, 'close' FROM card
+WHERE number = ? AND balance != 0;'''
+DELETE_CARD = 'DELETE FROM card WHERE number = ?';
+
+
+def connect(db_filepath):
+    """Set a database connection to the SQLite database.
+
+    Args:
+        db_filepath (str): path to database file
+
+    Returns:
+        obj: Connection object or None
+    """
+    try:
+        connection = sqlite3.connect(db_filepath, factory=_connection_class())
+    except Error as e:
+        print(e)
+        connection = None
+
+    return connection
+
+
+class QueryLog:
+    """Logs slow statements and the query plan of every distinct statement.
+
+    Bound parameters are never logged, only their number.
+    """
+
+    def __init__(self, threshold=0.1, logger=None):
+        """Initialize the log.
+
+        Args:
+            threshold (float): seconds above which a statement is logged
+            logger (Logger): destination, `database.queries` by default
+        """
+        if logger is None:
+            # Imported here, it roughly doubles the import time otherwise
+            import logging
+            logger = logging.getLogger('database.queries')
+
+        self.threshold = threshold
+        self.logger = logger
+        self.plans = {}
+        self._lock = threading.Lock()
+
+    def explain(self, connection, sql, parameters):
+        """Capture the query plan of a statement seen for the first time."""
+        if sql in self.plans:
+            return
+
+        try:
+            rows = sqlite3.Connection.execute(
+                connection, f'EXPLAIN QUERY PLAN {sql}', parameters
+            ).fetchall()
+            plan = [row[-1] for row in rows]
+        except Error as e:
+            plan = [f'unavailable: {e}']
+
+        with self._lock:
+            if sql in self.plans:
+                return
+            self.plans[sql] = plan
+
+        if plan:
+            # Full table scans are what usually hides behind a slow query
+            subqueries = _subqueries(plan)
+            full_scan = any(_is_full_scan(step, subqueries) for step in plan)
+            log = self.logger.warning if full_scan else self.logger.info
+            log('Query plan of %s\n  %s', _compact(sql), '\n  '.join(plan))
+
+    def record(self, sql, parameter_count, elapsed):
+        if elapsed < self.threshold:
+            return
+
+        plan = self.plans.get(sql) or ['n/a']
+        self.logger.warning(
+            'Slow query (%.1f ms): %s [%d parameters redacted]\n  plan: %s',
+            elapsed * 1000, _compact(sql), parameter_count, '; '.join(plan)
+        )
+
+
+def _is_full_scan(step, subqueries=()):
+    """Tell a full scan of a table from index scans and constant rows.
+
+    Args:
+        step (str): detail of a query plan step
+        subqueries (set): names of subquery results built by earlier
+            MATERIALIZE or CO-ROUTINE steps of the same plan
+    """
+    words = step.split()
+    if len(words) < 2 or words[0] != 'SCAN' or 'USING' in words:
+        return False
+    if words[-1] in ('ROW', 'ROWS'):
+        return False
+
+    table = words[2] if words[1] == 'TABLE' and len(words) > 2 else words[1]
+    # Lookups of the schema and scans of subquery results aren't tables
+    return not (table.startswith(('sqlite_', '(')) or table in subqueries)
+
+
+def _subqueries(plan):
+    """Collect the names of subquery results built by a query plan."""
+    return {words[1] for words in map(str.split, plan)
+            if len(words) > 1 and words[0] in ('MATERIALIZE', 'CO-ROUTINE')}
+
+
+def _compact(sql):
+    return ' '.join(sql.split())
+
+
+class TracingConnection(sqlite3.Connection):
+    """Connection timing its statements while a QueryLog is enabled.
+
+    Only the execute() call is timed; rows of a SELECT fetched afterwards
+    aren't included.
+    """
+
+    def execute(self, sql, parameters=()):
+        query_log = _query_log
+        if query_log is None:
+            return super().execute(sql, parameters)
+
+        query_log.explain(self, sql, parameters)
+        start = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            query_log.record(sql, len(parameters),
+                             time.perf_counter() - start)
+
+    def executemany(self, sql, seq_of_parameters):
+        query_log = _query_log
+        if query_log is None:
+            return super().executemany(sql, seq_of_parameters)
+
+        query_log.explain(self, sql, [None] * sql.count('?'))
+        start = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            query_log.record(sql, 0, time.perf_counter() - start)
+
+
+_query_log = None
+
+
+def enable_query_log(threshold=0.1, logger=None):
+    """Time statements of connections opened from now on.
+
+    Args:
+        threshold (float): seconds above which a statement is logged
+        logger (Logger): destination, `database.queries` by default
+
+    Returns:
+        QueryLog: the active log, its `plans` hold the captured plans
+    """
+    global _query_log
+    _query_log = QueryLog(threshold, logger)
+    return _query_log
+
+
+def disable_query_log():
+    global _query_log
+    _query_log = None
+
+
+def _connection_class():
+    return sqlite3.Connection if _query_log is None else TracingConnection
+
+
+# Maximum number of host parameters used in a single IN (...) query
+MAX_VARIABLES = 500
+
+
+class ConnectionPool:
+    """Hands out one tuned SQLite connection per thread.
+
+    Connections use WAL journaling, so readers don't block the writer and
+    vice versa, and relaxed `synchronous=NORMAL`, which is still durable
+    across application crashes.
+    """
+
+    def __init__(self, db_filepath, cache_size=64 * 1024,
+                 mmap_size=256 * 1024 * 1024, busy_timeout=5000):
+        """Initialize a pool for a database file.
+
+        Args:
+            db_filepath (str): path to database file
+            cache_size (int): page cache size per connection in KiB
+            mmap_size (int): bytes of the database file to memory-map
+            busy_timeout (int): milliseconds to wait for a lock
+        """
+        self.db_filepath = db_filepath
+        self.pragmas = {
+            'journal_mode': 'WAL',
+            'synchronous': 'NORMAL',
+            'cache_size': -cache_size,
+            'mmap_size': mmap_size,
+            'busy_timeout': busy_timeout,
+        }
+        self._local = threading.local()
+        self._connections = []
+        self._lock = threading.Lock()
+
+    def _open(self):
+        connection = sqlite3.connect(
+            self.db_filepath,
+            timeout=self.pragmas['busy_timeout'] / 1000,
+            check_same_thread=False,
+            factory=_connection_class(),
+        )
+        for pragma, value in self.pragmas.items():
+            connection.execute(f'PRAGMA {pragma} = {value};')
+
+        with self._lock:
+            self._connections.append(connection)
+        self._local.connection = connection
+
+        return connection
+
+    @contextmanager
+    def connection(self):
+        """Borrow the calling thread's connection.
+
+        A transaction left open by the caller is rolled back on return.
+        """
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = self._open()
+
+        try:
+            yield connection
+        finally:
+            if connection.in_transaction:
+                connection.rollback()
+
+    def close(self):
+        """Close the connections of all threads."""
+        with self._lock:
+            connections, self._connections = self._connections, []
+
+        for connection in connections:
+            connection.close()
+        self._local = threading.local()
+
+
+def create_table(connection, integer_numbers=False):
+    """Create missing tables.
+
+    Args:
+        connection (obj): Connection object
+        integer_numbers (bool): whether a new card table stores card
+            numbers as integers, existing tables are left as they are
+    """
+    with connection as c:
+        if integer_numbers:
+            c.execute(CREATE_INTEGER_TABLE.format('card'))
+        else:
+            c.execute(CREATE_TABLE)
+        c.execute(CREATE_ISSUER_TABLE)
+        c.execute(CREATE_IDEMPOTENCY_TABLE)
+
+        if not c.execute(HAS_LEDGER_TABLE).fetchone():
+            c.execute(CREATE_LEDGER_TABLE)
+            c.execute(OPEN_LEDGER)
+        c.execute(CREATE_LEDGER_INDEX)
+        for trigger in CREATE_LEDGER_TRIGGERS:
+            c.execute(trigger)
+
+
+def has_integer_numbers(connection):
+    """Check whether the card table stores card numbers as integers."""
+    row = connection.execute(GET_NUMBER_TYPE).fetchone()
+    return row is not None and row[0].upper() == 'INTEGER'
+
+
+def migrate_to_integer_numbers(connection):
+    """Convert the card table to store card numbers as integers.
+
+    The table is rebuilt in a single transaction keeping ids and the
+    AUTOINCREMENT sequence, so nothing changes for callers. Run VACUUM
+    afterwards to give the freed pages back to the file system.
+
+    Returns:
+        bool: False if the table already stored integers
+
+    Raises:
+        ValueError: if some number can't be stored as an integer without
+            losing information, e.g. one with a leading zero
+    """
+    if has_integer_numbers(connection):
+        return False
+
+    with connection as c:
+        c.execute(BEGIN_IMMEDIATE)
+        invalid = c.execute(COUNT_NON_INTEGER_NUMBERS).fetchone()[0]
+        if invalid:
+            raise ValueError(f'{invalid} card numbers are not integers')
+
+        sequence = c.execute(GET_CARD_SEQUENCE).fetchone()
+        c.execute(CREATE_INTEGER_TABLE.format('card_new'))
+        c.execute(COPY_TO_INTEGER_TABLE)
+        for statement in REPLACE_CARD_TABLE:
+            c.execute(statement)
+        if sequence is not None:
+            delete, insert = SET_CARD_SEQUENCE
+            c.execute(delete)
+            c.execute(insert, sequence)
+
+    return True
+
+
+def add_card(connection, number, pin):
+    with connection as c:
+        c.execute(INSERT_CARD, (number, pin))
+
+
+def add_cards(connection, cards):
+    """Insert many cards in a single transaction.
+
+    Args:
+        connection (obj): Connection object
+        cards (iterable): (number, pin) pairs
+    """
+    with connection as c:
+        c.executemany(INSERT_CARD, cards)
+
+
+def get_existing_numbers(connection, numbers):
+    """Find which of the given card numbers are already in the database.
+
+    Args:
+        connection (obj): Connection object
+        numbers (list): card numbers to be checked
+
+    Returns:
+        set: card numbers that exist in the database
+    """
+    existing = set()
+    with connection as c:
+        for i in range(0, len(numbers), MAX_VARIABLES):
+            chunk = numbers[i:i + MAX_VARIABLES]
+            query = GET_EXISTING_NUMBERS.format(', '.join('?' * len(chunk)))
+            existing.update(row[0] for row in c.execute(query, chunk))
+
+    return existing
+
+
+def reserve_account_ids(connection, issuer_num, count, key):
+    """Reserve a range of account identifier indexes for an issuer.
+
+    The issuer's row is created with the given key on first use, later
+    calls keep the stored key so that the allocation stays collision-free.
+
+    Arguments:
+        connection (obj): Connection object
+        issuer_num (str): Bank Identification Number
+        count (int): number of indexes to reserve
+        key (int): permutation key used if the issuer is new
+
+    Returns:
+        tuple: (key, first reserved index)
+    """
+    with connection as c:
+        c.execute(INSERT_ISSUER, (issuer_num, key))
+        c.execute(RESERVE_ACCOUNT_IDS, (count, issuer_num))
+        key, next_index = c.execute(GET_ISSUER, (issuer_num,)).fetchone()
+
+    return key, next_index - count
+
+
+def get_card_by_number(connection, number):
+    with connection as c:
+        return c.execute(GET_CARD_BY_NUMBER, (number,)).fetchall()
+
+
+def get_all_cards(connection):
+    with connection as c:
+        return c.execute(GET_ALL_CARDS).fetchall()
+
+
+def iter_cards(connection, batch_size=1000, after_id=0, with_id=False):
+    """Stream all cards in `id` order in constant memory.
+
+    Cards are read in pages of `batch_size` rows, each page continuing
+    after the last id of the previous one, so no read transaction is held
+    between pages and an interrupted scan can be resumed.
+
+    Arguments:
+        connection (obj): Connection object
+        batch_size (int): number of rows fetched per query
+        after_id (int): only return cards with a greater id
+        with_id (bool): whether to prepend the id to every row
+
+    Yields:
+        tuple: (number, pin, balance) or (id, number, pin, balance)
+    """
+    while True:
+        cursor = connection.execute(GET_CARDS_PAGE, (after_id, batch_size))
+        rows = cursor.fetchmany(batch_size)
+        if not rows:
+            return
+
+        after_id = rows[-1][0]
+        for row in rows:
+            yield row if with_id else row[1:]
+
+        if len(rows) < batch_size:
+            return
+
+
+@contextmanager
+def read_snapshot(connection):
+    """Run all queries of the block in a single read transaction.
+
+    Every query sees the database as of the first one, however many
+    pages are read. In WAL mode writers carry on meanwhile; with a
+    rollback journal they wait until the block ends.
+    """
+    connection.execute(BEGIN)
+    try:
+        yield connection
+    finally:
+        connection.rollback()
+
+
+def count_cards(connection):
+    return connection.execute(COUNT_CARDS).fetchone()[0]
+
+
+def add_income(connection, number, income):
+    """Add money to the account's current balance.
+
+    The deposit is recorded in the ledger in the same transaction.
+
+    Arguments:
+        connection (obj): Connection object
+        number (str): account number
+        income (int): money to be added to the current account's balance
+
+    Returns:
+        bool: see `deposit`
+    """
+    with connection as c:
+        return deposit(c, number, income)
+
+
+def deposit(connection, number, income):
+    """Add money to an account within the caller's transaction.
+
+    Returns:
+        bool: True if the account exists and its balance stays below
+            MAX_BALANCE
+    """
+    if not connection.execute(ADD_INCOME, (income, number, income)).rowcount:
+        return False
+
+    connection.execute(INSERT_DEPOSIT, (number, income))
+    return True
+
+
+def transfer(connection, src, dst, amount):
+    """Move money between two accounts in a single transaction.
+
+    The write lock is taken up front, and the debit only succeeds if the
+    source account holds enough money, so the balance check, both updates
+    and their ledger entries happen atomically.
+
+    Arguments:
+        connection (obj): Connection object
+        src (str): sender's account number
+        dst (str): receiver's account number
+        amount (int): money to be transferred
+
+    Returns:
+        bool: True if the money was transferred, False if the amount
+            isn't positive, the sender doesn't have enough money, either
+            account doesn't exist or the receiver's balance would exceed
+            MAX_BALANCE
+    """
+    with connection as c:
+        if not c.in_transaction:
+            c.execute(BEGIN_IMMEDIATE)
+
+        return move(c, src, dst, amount)
+
+
+def move(connection, src, dst, amount):
+    """Move money between accounts within the caller's transaction.
+
+    Returns:
+        bool: True if the money was moved, see `transfer`
+    """
+    debit = (amount, src, amount, amount)
+    if not connection.execute(WITHDRAW, debit).rowcount:
+        return False
+
+    if not connection.execute(ADD_INCOME, (amount, dst, amount)).rowcount:
+        # Give the money back, the caller's transaction stays usable
+        connection.execute(ADD_INCOME, (amount, src, amount))
+        return False
+
+    connection.execute(INSERT_TRANSFER, (src, dst, -amount, dst, src, amount))
+    return True
+
+
+def transfer_many(connection, src, items):
+    """Pay many accounts from one account in a single transaction.
+
+    Arguments:
+        connection (obj): Connection object
+        src (str): sender's account number
+        items (list): (receiver's account number, amount) pairs
+
+    Returns:
+        bool: True if all the money was transferred, False if nothing was
+            because some amount isn't positive, the sender doesn't have
+            enough money for all items, some account doesn't exist or a
+            receiver's balance would exceed MAX_BALANCE
+    """
+    with connection as c:
+        c.execute(BEGIN_IMMEDIATE)
+        return move_many(c, src, items)
+
+
+def move_many(connection, src, items):
+    """Pay many accounts within the caller's transaction.
+
+    The sender's balance is checked against the total once, all credits
+    and ledger entries are written with one `executemany` each.
+
+    Returns:
+        bool: True if the money was moved, see `transfer_many`
+    """
+    if not all(amount > 0 for _, amount in items):
+        return False
+
+    total = sum(amount for _, amount in items)
+    credits = [(amount, dst, amount) for dst, amount in items]
+
+    connection.execute(SAVEPOINT.format('move_many'))
+    if (connection.execute(WITHDRAW, (total, src, total, total)).rowcount
+            and connection.executemany(ADD_INCOME, credits).rowcount
+            == len(items)):
+        connection.execute(RELEASE.format('move_many'))
+        connection.executemany(INSERT_TRANSFER, [
+            (src, dst, -amount, dst, src, amount) for dst, amount in items
+        ])
+        return True
+
+    # Undo whatever was written, the caller's transaction stays usable
+    connection.execute(ROLLBACK_TO.format('move_many'))
+    connection.execute(RELEASE.format('move_many'))
+    return False
+
+
+def get_idempotent_result(connection, key):
+    """Get the outcome saved under an idempotency key.
+
+    Returns:
+        tuple: (request, balance), or None if the key is unused
+    """
+    return connection.execute(GET_IDEMPOTENT_RESULT, (key,)).fetchone()
+
+
+def run_once(connection, key, request, operation, args, account):
+    """Apply an operation in its own transaction at most once per key.
+
+    Arguments:
+        connection (obj): Connection object
+        key, request, operation, args, account: see `apply_once`
+
+    Returns:
+        tuple: see `apply_once`
+    """
+    with connection as c:
+        c.execute(BEGIN_IMMEDIATE)
+        return apply_once(c, key, request, operation, args, account)
+
+
+def apply_once(connection, key, request, operation, args, account):
+    """Apply an operation within the caller's transaction once per key.
+
+    If the key is new, the operation runs and, if it succeeds, the
+    balance of `account` right after it is saved under the key in the
+    same transaction. If the key was used before, nothing runs and the
+    saved outcome is returned instead; an operation that failed saved
+    nothing, so it may be retried.
+
+    Arguments:
+        connection (obj): Connection object
+        key (str): idempotency key chosen by the client
+        request (str): description of the request, lets callers detect a
+            key reused for a different request
+        operation (callable): `deposit` or `move`
+        args (tuple): arguments of the operation after the connection
+        account (str): account whose resulting balance is saved
+
+    Returns:
+        tuple: (request, balance) saved under the key, or None if the
+            operation failed
+    """
+    row = connection.execute(GET_IDEMPOTENT_RESULT, (key,)).fetchone()
+    if row is not None:
+        return row
+
+    if not operation(connection, *args):
+        return None
+
+    balance, = connection.execute(GET_BALANCE, (account,)).fetchone()
+    connection.execute(INSERT_IDEMPOTENT_RESULT, (key, request, balance))
+    return request, balance
+
+
+def get_history(connection, number, limit=100, before_id=None):
+    """Get the newest ledger entries of an account.
+
+    Arguments:
+        connection (obj): Connection object
+        number (str): account number
+        limit (int): maximum number of entries
+        before_id (int): only return entries older than this one, used to
+            page through the history
+
+    Returns:
+        list: (id, account, counterparty, amount, kind, created_at) rows,
+            newest first
+    """
+    if before_id is None:
+        before_id = 2 ** 63 - 1
+
+    with connection as c:
+        return c.execute(GET_HISTORY, (number, before_id, limit)).fetchall()
+
+
+def rebuild_balances(connection):
+    """Recompute every card's balance from the ledger.
+
+    Returns:
+        int: number of cards whose balance was corrected
+    """
+    with connection as c:
+        if not c.in_transaction:
+            c.execute(BEGIN_IMMEDIATE)
+
+        corrected = c.execute(REBUILD_BALANCES).rowcount
+        corrected += c.execute(CLEAR_UNBOOKED_BALANCES).rowcount
+
+    return corrected
+
+
+def stage_import(connection):
+    """Create an empty staging table for a bulk import of cards."""
+    with connection as c:
+        c.execute(CREATE_IMPORT_TABLE)
+        c.execute(CLEAR_IMPORT_TABLE)
+
+
+def add_staged_cards(connection, rows):
+    """Add cards to the staging table in a single transaction.
+
+    Arguments:
+        connection (obj): Connection object
+        rows (iterable): (line, number, pin, balance) tuples, lines
+            identify rows in the import report and, like the numbers,
+            must be unique
+    """
+    with connection as c:
+        c.executemany(INSERT_IMPORT, rows)
+
+
+def merge_staged_cards(connection):
+    """Insert staged cards whose numbers are new in a single transaction.
+
+    Rows of numbers already in `card` are rejected. Balances of the
+    inserted cards are booked as opening ledger entries.
+
+    Returns:
+        tuple: (number of inserted cards, list of (line, number, reason)
+            of the rejected rows)
+    """
+    with connection as c:
+        c.execute(BEGIN_IMMEDIATE)
+        c.execute(REJECT_IMPORT_EXISTING)
+        inserted = c.execute(INSERT_IMPORTED_CARDS).rowcount
+        c.execute(OPEN_IMPORTED_LEDGER)
+        rejected = c.execute(GET_IMPORT_REJECTS).fetchall()
+        c.execute(CLEAR_IMPORT_TABLE)
+
+    return inserted, rejected
+
+
+def update_pins(connection, rows):
+    """Replace PINs of many cards in a single transaction.
+
+    Arguments:
+        connection (obj): Connection object
+        rows (list): (new pin, card id, expected current pin) triples,
+            cards whose PIN differs from the expected one are skipped
+
+    Returns:
+        int: number of updated cards
+    """
+    with connection as c:
+        return c.executemany(UPDATE_PIN, rows).rowcount
+
+
+def delete_card(connection, number):
+    """Delete card entity from the database.
+
+    A remaining balance is booked as a 'close' entry in the same
+    transaction, so the ledger still adds up to the balances.
+    """
+    with connection as c:
+        c.execute(BEGIN_IMMEDIATE)
+        c.execute(CLOSE_LEDGER, (number,))
+        c.execute(DELETE_CARD, (number,))
@@ -0,0 +1,238 @@
+"""
+Streaming export of the card table to CSV, JSON Lines or a columnar file.
+
+Cards are read page by page in `id` order inside one read transaction,
+so the file is a consistent snapshot taken in constant memory, and in
+WAL mode writers are never blocked by a running export. Files ending in
+`.gz` are gzip-compressed and every file is written under a temporary
+name first, so readers never see a partial export.
+
+PINs are left out unless asked for; CSV and JSON Lines exports with PINs
+can be loaded again by importer.py.
+
+The columnar format starts with COLUMNAR_MAGIC and a flags byte, followed
+by row groups of up to GROUP_SIZE cards and an empty group marking the
+end. A group is its little-endian uint32 row count, then the ids, card
+numbers and balances as little-endian int64 columns and, if the PIN flag
+is set, the uint32 length of the newline-joined UTF-8 PINs and the PINs.
+
+Usage:
+    python exporter.py FILE [--db PATH] [--format csv|jsonl|columnar]
+                            [--pins] [--batch-size N]
+"""
+import argparse
+import csv
+import gzip
+import itertools
+import json
+import os
+import sqlite3
+import struct
+import sys
+import time
+from array import array
+
+import database
+
+
+DB_FILEPATH = 'card.s3db'
+BATCH_SIZE = 10_000
+GROUP_SIZE = 65_536
+
+COLUMNAR_MAGIC = b'CARDCOL1'
+_WITH_PINS = 1
+_COUNT = struct.Struct('<I')
+
+
+def open_output(filepath, binary=False):
+    """Open a possibly gzip-compressed file for writing."""
+    if filepath.endswith('.gz'):
+        return gzip.open(filepath, 'wb' if binary else 'wt',
+                         compresslevel=6, newline=None if binary else '')
+    if binary:
+        return open(filepath, 'wb')
+    return open(filepath, 'w', newline='')
+
+
+def write_csv(f, rows, with_pins):
+    writer = csv.writer(f)
+    if with_pins:
+        writer.writerow(['number', 'pin', 'balance'])
+        writer.writerows((number, pin, balance)
+                         for _, number, pin, balance in rows)
+    else:
+        writer.writerow(['number', 'balance'])
+        writer.writerows((number, balance) for _, number, _, balance in rows)
+
+
+def write_jsonl(f, rows, with_pins):
+    for _, number, pin, balance in rows:
+        record = {'number': number, 'balance': balance}
+        if with_pins:
+            record['pin'] = pin
+        f.write(json.dumps(record))
+        f.write('\n')
+
+
+def _column(values):
+    column = array('q', values)
+    if sys.byteorder == 'big':
+        column.byteswap()
+    return column.tobytes()
+
+
+def write_columnar(f, rows, with_pins):
+    f.write(COLUMNAR_MAGIC)
+    f.write(bytes([_WITH_PINS if with_pins else 0]))
+
+    rows = iter(rows)
+    while group := list(itertools.islice(rows, GROUP_SIZE)):
+        ids, numbers, pins, balances = zip(*group)
+        f.write(_COUNT.pack(len(group)))
+        f.write(_column(ids))
+        f.write(_column(map(int, numbers)))
+        f.write(_column(balances))
+        if with_pins:
+            blob = '\n'.join(pins).encode()
+            f.write(_COUNT.pack(len(blob)))
+            f.write(blob)
+
+    f.write(_COUNT.pack(0))
+
+
+def _read_column(f, count):
+    column = array('q')
+    column.frombytes(f.read(8 * count))
+    if sys.byteorder == 'big':
+        column.byteswap()
+    return column
+
+
+def read_columnar(f):
+    """Yield the (id, number, pin, balance) rows of a columnar export.
+
+    PINs are None if the export left them out.
+
+    Raises:
+        ValueError: if the file isn't a columnar export
+    """
+    if f.read(len(COLUMNAR_MAGIC)) != COLUMNAR_MAGIC:
+        raise ValueError('Not a columnar card export')
+    with_pins = f.read(1)[0] & _WITH_PINS
+
+    while True:
+        count, = _COUNT.unpack(f.read(_COUNT.size))
+        if not count:
+            return
+
+        ids = _read_column(f, count)
+        numbers = _read_column(f, count)
+        balances = _read_column(f, count)
+        if with_pins:
+            length, = _COUNT.unpack(f.read(_COUNT.size))
+            pins = f.read(length).decode().split('\n')
+        else:
+            pins = itertools.repeat(None, count)
+
+        yield from zip(ids, map(str, numbers), pins, balances)
+
+
+WRITERS = {
+    'csv': write_csv,
+    'jsonl': write_jsonl,
+    'columnar': write_columnar,
+}
+
+
+def open_database(db_filepath):
+    """Open a database to be exported from.
+
+    Raises:
+        FileNotFoundError: if the database doesn't exist
+    """
+    if not os.path.exists(db_filepath):
+        raise FileNotFoundError(f'{db_filepath} does not exist')
+
+    # Read-only, so that a mistyped path can't create an empty database
+    return sqlite3.connect(f'file:{db_filepath}?mode=ro', uri=True)
+
+
+def export_cards(connection, f, file_format='csv', with_pins=False,
+                 batch_size=BATCH_SIZE):
+    """Write a consistent snapshot of all cards to a file.
+
+    Args:
+        connection (obj): Connection object without an open transaction
+        f (file): text file for CSV and JSON Lines, binary for columnar
+        file_format (str): one of WRITERS
+        with_pins (bool): whether to export PINs, hashed or not
+        batch_size (int): number of rows read per query
+
+    Returns:
+        int: number of exported cards
+    """
+    count = 0
+
+    def counted(rows):
+        nonlocal count
+        for count, row in enumerate(rows, 1):
+            yield row
+
+    with database.read_snapshot(connection):
+        rows = counted(database.iter_cards(connection, batch_size,
+                                           with_id=True))
+        WRITERS[file_format](f, rows, with_pins)
+
+    return count
+
+
+def guess_format(filepath):
+    name = filepath.removesuffix('.gz')
+    if name.endswith(('.jsonl', '.ndjson')):
+        return 'jsonl'
+    if name.endswith(('.col', '.bin')):
+        return 'columnar'
+    return 'csv'
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('file')
+    parser.add_argument('--db', default=DB_FILEPATH)
+    parser.add_argument('--format', choices=WRITERS,
+                        help='file format, guessed from the name by default')
+    parser.add_argument('--pins', action='store_true',
+                        help='include PINs in the export')
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+    args = parser.parse_args()
+
+    file_format = args.format or guess_format(args.file)
+    temp_filepath = f'{args.file}.tmp'
+    if args.file.endswith('.gz'):
+        temp_filepath = f'{args.file[:-3]}.tmp.gz'
+
+    try:
+        connection = open_database(args.db)
+    except FileNotFoundError as e:
+        print(e)
+        raise SystemExit(1)
+
+    start = time.perf_counter()
+    try:
+        with open_output(temp_filepath, file_format == 'columnar') as f:
+            count = export_cards(connection, f, file_format, args.pins,
+                                 args.batch_size)
+        os.replace(temp_filepath, args.file)
+    finally:
+        connection.close()
+        if os.path.exists(temp_filepath):
+            os.remove(temp_filepath)
+    elapsed = time.perf_counter() - start
+
+    print(f'{count:,} cards exported to {args.file} in {elapsed:.1f} s '
+          f'({count / elapsed:,.0f} rows/s, '
+          f'{os.path.getsize(args.file) / 1e6:,.1f} MB).')
+
+
+if __name__ == '__main__':
+    main()
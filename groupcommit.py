@@ -0,0 +1,164 @@
+"""
+Group commit of deposits and transfers.
+
+A single writer thread collects operations from any number of callers and
+applies up to `max_batch` of them, or whatever arrived within `max_delay`
+seconds, in one transaction. Each caller waits on its own future, so many
+operations share a single commit and fsync.
+"""
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+import database
+
+
+_STOP = object()
+
+
+class GroupCommitWriter:
+    """Single-writer queue applying deposits and transfers in batches."""
+
+    def __init__(self, pool, max_batch=256, max_delay=0.002):
+        """Initialize the writer and start its thread.
+
+        Args:
+            pool (ConnectionPool): pool providing the writer's connection
+            max_batch (int): maximum number of operations per transaction
+            max_delay (float): seconds to wait for more operations after
+                the first one of a batch has arrived
+        """
+        self.pool = pool
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.batches = 0
+        self.operations = 0
+        self._queue = queue.SimpleQueue()
+        self._thread = threading.Thread(target=self._run,
+                                        name='bank-group-commit',
+                                        daemon=True)
+        self._thread.start()
+
+    def submit_deposit(self, number, income):
+        """Queue a deposit.
+
+        Returns:
+            Future: resolves to True if the account exists
+        """
+        return self._submit(database.deposit, (number, income))
+
+    def submit_transfer(self, src, dst, amount):
+        """Queue a transfer.
+
+        Returns:
+            Future: resolves to True if the money was transferred, False if
+                the sender doesn't have enough money or an account is missing
+        """
+        return self._submit(database.move, (src, dst, amount))
+
+    def submit_transfers(self, src, items):
+        """Queue payments from one account to many.
+
+        Returns:
+            Future: resolves like `database.transfer_many`
+        """
+        return self._submit(database.move_many, (src, items))
+
+    def submit_once(self, key, request, operation, args, account):
+        """Queue a deposit or transfer applied at most once per key.
+
+        Returns:
+            Future: resolves like `database.apply_once`
+        """
+        return self._submit(database.apply_once,
+                            (key, request, operation, args, account))
+
+    def _submit(self, operation, args):
+        future = Future()
+        self._queue.put((operation, args, future))
+        return future
+
+    def close(self):
+        """Apply the queued operations and stop the writer thread."""
+        self._queue.put(_STOP)
+        self._thread.join()
+
+    def _collect(self, first):
+        """Gather a batch starting with `first`.
+
+        Returns:
+            tuple: (batch, True if the writer was asked to stop)
+        """
+        batch = [first]
+        deadline = time.monotonic() + self.max_delay
+        while len(batch) < self.max_batch:
+            try:
+                timeout = max(0, deadline - time.monotonic())
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                break
+
+            if item is _STOP:
+                return batch, True
+            batch.append(item)
+
+        return batch, False
+
+    def _apply(self, connection, batch):
+        """Execute a batch in one transaction and resolve its futures.
+
+        Every operation runs in its own savepoint: one that raises is
+        rolled back and fails only its own future. Only a failure of the
+        transaction itself fails the whole batch.
+        """
+        batch = [item for item in batch
+                 if item[2].set_running_or_notify_cancel()]
+        outcomes = []
+        try:
+            with connection as c:
+                c.execute(database.BEGIN_IMMEDIATE)
+                for operation, args, _ in batch:
+                    outcomes.append(self._attempt(c, operation, args))
+        except Exception as e:
+            for _, _, future in batch:
+                future.set_exception(e)
+            return
+
+        self.batches += 1
+        self.operations += len(batch)
+        for (_, _, future), (result, error) in zip(batch, outcomes):
+            if error is None:
+                future.set_result(result)
+            else:
+                future.set_exception(error)
+
+    @staticmethod
+    def _attempt(connection, operation, args):
+        """Run one operation of a batch inside a savepoint.
+
+        Returns:
+            tuple: (result, None) or (None, exception raised by the
+                operation)
+        """
+        connection.execute(database.SAVEPOINT.format('operation'))
+        try:
+            result = operation(connection, *args)
+        except Exception as e:
+            connection.execute(database.ROLLBACK_TO.format('operation'))
+            connection.execute(database.RELEASE.format('operation'))
+            return None, e
+
+        connection.execute(database.RELEASE.format('operation'))
+        return result, None
+
+    def _run(self):
+        with self.pool.connection() as connection:
+            stop = False
+            while not stop:
+                item = self._queue.get()
+                if item is _STOP:
+                    break
+
+                batch, stop = self._collect(item)
+                self._apply(connection, batch)
@@ -0,0 +1,292 @@
+"""
+Bulk import of cards and balances from CSV or JSON Lines files.
+
+Rows are validated in chunks, card numbers with one batched Luhn pass,
+and staged with `executemany` in a temporary table. Once the whole file
+is staged, a single transaction rejects numbers that already exist and
+inserts the new cards in number order, so the live tables are locked
+only briefly.
+
+CSV files hold `number,pin,balance` rows with an optional header, JSON
+Lines files hold one `{"number": ..., "pin": ..., "balance": ...}`
+object per line. Files ending in `.gz` are decompressed on the fly.
+
+PINs may be plaintext or already hashed. Plaintext PINs are hashed in a
+process pool before they are staged, unless `--plaintext-pins` asks to
+store them as they are, to be hashed later by `migrate.py hash-pins`.
+
+Usage:
+    python importer.py FILE [--db PATH] [--format csv|jsonl]
+                            [--rejects FILE] [--issuer BIN]
+                            [--kdf scrypt] [--workers N] [--plaintext-pins]
+"""
+import argparse
+import csv
+import gzip
+import itertools
+import json
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+
+import database
+import issuance
+import luhn
+import pins
+
+
+DB_FILEPATH = 'card.s3db'
+CHUNK_SIZE = 50_000
+
+HEADER = ['number', 'pin', 'balance']
+
+# Set lookups are the cheapest way to validate millions of plaintext PINs
+_PLAIN_PINS = frozenset(f'{pin:04}' for pin in range(10000))
+
+
+@dataclass
+class ImportReport:
+    """Outcome of an import."""
+
+    read: int = 0
+    imported: int = 0
+    plaintext_pins: int = 0
+    rejected: Counter = field(default_factory=Counter)
+
+
+def open_text(filepath):
+    """Open a possibly gzip-compressed text file for reading."""
+    if filepath.endswith('.gz'):
+        return gzip.open(filepath, 'rt', newline='')
+    return open(filepath, newline='')
+
+
+def read_csv(f):
+    """Yield (line, fields) of a CSV file, fields None if malformed."""
+    for line, fields in enumerate(csv.reader(f), 1):
+        if line == 1 and fields == HEADER:
+            continue
+        if len(fields) == 2:
+            fields.append('0')
+        yield line, fields if len(fields) == 3 else None
+
+
+def read_jsonl(f):
+    """Yield (line, fields) of a JSON Lines file, fields None if malformed."""
+    for line, text in enumerate(f, 1):
+        if not text.strip():
+            continue
+        try:
+            record = json.loads(text)
+            fields = [record['number'], record['pin'],
+                      record.get('balance', 0)]
+        except (ValueError, TypeError, KeyError):
+            fields = None
+        yield line, fields
+
+
+READERS = {
+    'csv': read_csv,
+    'jsonl': read_jsonl,
+}
+
+
+def _is_pin(pin):
+    return pin in _PLAIN_PINS or pins.is_well_formed(pin)
+
+
+def _parse_balance(balance):
+    """Return a balance as int, -1 if it isn't a whole number or exceeds
+    the largest balance a card can hold."""
+    if isinstance(balance, bool) or not isinstance(balance, (int, str)):
+        return -1
+    try:
+        balance = int(balance)
+    except ValueError:
+        return -1
+    return balance if balance <= database.MAX_BALANCE else -1
+
+
+def validate_chunk(rows, seen, issuers=(issuance.ISSUER_NUM,)):
+    """Split a chunk of parsed rows into valid and rejected ones.
+
+    Args:
+        rows (list): (line, fields) pairs from one of READERS
+        seen (set): numbers of earlier valid rows, updated in place; the
+            first row of a number wins
+        issuers (tuple): Bank Identification Numbers of accepted cards
+
+    Returns:
+        tuple: (list of (line, number, pin, balance) rows ready for
+            staging, list of (line, number, reason) rejections)
+    """
+    rejected = []
+    parsed = []
+    for line, fields in rows:
+        if fields is None:
+            rejected.append((line, None, 'malformed row'))
+            continue
+
+        number, pin, balance = fields
+        parsed.append((line, str(number).strip(), str(pin).strip(),
+                       _parse_balance(balance)))
+
+    valid = []
+    mask = luhn.validate_batch([row[1] for row in parsed])
+    for row, is_valid in zip(parsed, mask):
+        line, number, pin, balance = row
+        if not is_valid or not issuance.is_card_number(number):
+            rejected.append((line, number, 'invalid number'))
+        elif not number.startswith(issuers):
+            rejected.append((line, number, 'unknown issuer'))
+        elif not _is_pin(pin):
+            rejected.append((line, number, 'invalid PIN'))
+        elif balance < 0:
+            rejected.append((line, number, 'invalid balance'))
+        elif number in seen:
+            rejected.append((line, number, 'duplicate number'))
+        else:
+            seen.add(number)
+            valid.append(row)
+
+    return valid, rejected
+
+
+def hash_plain_pins(rows, hasher, executor):
+    """Replace plaintext PINs of validated rows by their hashes.
+
+    Args:
+        rows (list): (line, number, pin, balance) rows, updated in place
+        hasher (PinHasher): hasher of the PINs
+        executor (Executor): pool the hashes are computed in
+
+    Returns:
+        list: the rows
+    """
+    plain = [i for i, row in enumerate(rows) if row[2] in _PLAIN_PINS]
+    hashes = executor.map(hasher.hash, [rows[i][2] for i in plain],
+                          chunksize=64)
+    for i, hashed in zip(plain, hashes):
+        line, number, _, balance = rows[i]
+        rows[i] = (line, number, hashed, balance)
+
+    return rows
+
+
+def import_cards(connection, rows, chunk_size=CHUNK_SIZE, on_reject=None,
+                 pin_hasher=None, plaintext_pins=False, max_workers=None,
+                 issuers=(issuance.ISSUER_NUM,)):
+    """Import parsed rows into the card table.
+
+    Args:
+        connection (obj): Connection object
+        rows (iterable): (line, fields) pairs from one of READERS
+        chunk_size (int): rows validated and staged at once
+        on_reject (callable): optional callback receiving every rejected
+            row as (line, number, reason)
+        pin_hasher (PinHasher): hasher of plaintext PINs, scrypt by default
+        plaintext_pins (bool): store plaintext PINs as they are, they must
+            be hashed later with `pins.migrate_plaintext_pins`
+        max_workers (int): processes hashing PINs, one per CPU by default
+        issuers (tuple): Bank Identification Numbers of accepted cards,
+            cards of other issuers are rejected
+
+    Returns:
+        ImportReport: counts of read, imported and rejected rows, and of
+            plaintext PINs left to be hashed
+    """
+    report = ImportReport()
+    rejected = []
+    seen = set()
+
+    executor = None
+    if not plaintext_pins:
+        pin_hasher = pin_hasher or pins.PinHasher()
+        executor = ProcessPoolExecutor(max_workers)
+
+    database.stage_import(connection)
+    rows = iter(rows)
+    try:
+        while chunk := list(itertools.islice(rows, chunk_size)):
+            valid, invalid = validate_chunk(chunk, seen, issuers)
+            if executor is None:
+                report.plaintext_pins += sum(row[2] in _PLAIN_PINS
+                                             for row in valid)
+            else:
+                valid = hash_plain_pins(valid, pin_hasher, executor)
+            database.add_staged_cards(connection, valid)
+            report.read += len(chunk)
+            rejected += invalid
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+    report.imported, duplicates = database.merge_staged_cards(connection)
+    rejected += duplicates
+
+    for rejection in sorted(rejected, key=lambda r: r[0]):
+        report.rejected[rejection[2]] += 1
+        if on_reject is not None:
+            on_reject(rejection)
+
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('file')
+    parser.add_argument('--db', default=DB_FILEPATH)
+    parser.add_argument('--format', choices=READERS,
+                        help='file format, guessed from the name by default')
+    parser.add_argument('--rejects', help='write rejected rows as CSV')
+    parser.add_argument('--issuer', action='append', dest='issuers',
+                        help='accepted Bank Identification Number, may be '
+                             f'repeated; {issuance.ISSUER_NUM} by default')
+    parser.add_argument('--kdf', choices=['scrypt', 'pbkdf2_sha256'],
+                        default='scrypt', help='KDF of hashed PINs')
+    parser.add_argument('--workers', type=int,
+                        help='processes hashing PINs, one per CPU by default')
+    parser.add_argument('--plaintext-pins', action='store_true',
+                        help='store plaintext PINs unhashed, which is much '
+                             'faster; run migrate.py hash-pins afterwards')
+    args = parser.parse_args()
+
+    file_format = args.format
+    if file_format is None:
+        name = args.file.removesuffix('.gz')
+        is_jsonl = name.endswith(('.jsonl', '.ndjson'))
+        file_format = 'jsonl' if is_jsonl else 'csv'
+
+    connection = database.connect(args.db)
+    rejects = open(args.rejects, 'w', newline='') if args.rejects else None
+    try:
+        database.create_table(connection)
+        on_reject = csv.writer(rejects).writerow if rejects else None
+
+        start = time.perf_counter()
+        with open_text(args.file) as f:
+            report = import_cards(connection, READERS[file_format](f),
+                                  on_reject=on_reject,
+                                  pin_hasher=pins.PinHasher(args.kdf),
+                                  plaintext_pins=args.plaintext_pins,
+                                  max_workers=args.workers,
+                                  issuers=tuple(args.issuers
+                                                or [issuance.ISSUER_NUM]))
+        elapsed = time.perf_counter() - start
+    finally:
+        connection.close()
+        if rejects is not None:
+            rejects.close()
+
+    print(f'{report.imported:,} of {report.read:,} rows imported in '
+          f'{elapsed:.1f} s ({report.read / elapsed:,.0f} rows/s).')
+    for reason, count in report.rejected.most_common():
+        print(f'  {count:,} rejected: {reason}')
+    if report.plaintext_pins:
+        print('PINs were stored in plaintext, hash them now with: '
+              f'python migrate.py hash-pins --db {args.db}')
+
+
+if __name__ == '__main__':
+    main()
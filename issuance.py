@@ -0,0 +1,153 @@
+"""
+Bulk card issuance with collision-free account number allocation.
+
+Account identifiers are taken from a keyed permutation of the 10^9 possible
+9-digit identifiers. Every issuer walks the permutation with a counter kept
+in the database, so numbers never repeat and look random from the outside.
+"""
+import hashlib
+import random
+import secrets
+
+import database
+import luhn
+import pins
+
+
+ISSUER_NUM = '400000'
+ACCOUNT_ID_SPACE = 10 ** 9
+CARD_NUMBER_LENGTH = 16
+
+_ROUNDS = 4
+
+
+class AccountIdPermutation:
+    """Keyed pseudo-random permutation of [0, size).
+
+    A balanced Feistel network over the smallest even number of bits
+    covering the domain, combined with cycle walking: values falling outside
+    the domain are encrypted again until they land inside it, which keeps
+    the mapping a bijection.
+    """
+
+    def __init__(self, key, size=ACCOUNT_ID_SPACE):
+        if size < 1:
+            raise ValueError(f'Permutation size out of range: {size}')
+
+        self.half_bits = max(1, ((size - 1).bit_length() + 1) // 2)
+        self.half_mask = (1 << self.half_bits) - 1
+
+        digest = hashlib.sha256(str(key).encode()).digest()
+        self.round_keys = [
+            int.from_bytes(digest[4 * i:4 * i + 4], 'big')
+            for i in range(_ROUNDS)
+        ]
+        self.size = size
+
+    def _encrypt(self, value):
+        half_bits, half_mask = self.half_bits, self.half_mask
+        left, right = value >> half_bits, value & half_mask
+        for round_key in self.round_keys:
+            mixed = (right + round_key) * 0x9E3779B1 & 0xFFFFFFFF
+            mixed ^= mixed >> 16
+            left, right = right, left ^ (mixed & half_mask)
+
+        return left << half_bits | right
+
+    def __getitem__(self, index):
+        if not 0 <= index < self.size:
+            raise IndexError('Permutation index out of range')
+
+        value = self._encrypt(index)
+        while value >= self.size:
+            value = self._encrypt(value)
+
+        return value
+
+
+def is_card_number(number):
+    """Check that `number` is a card number in canonical form.
+
+    Only strings of 16 ASCII digits without a leading zero are canonical.
+    INTEGER number columns also match other spellings of the same value,
+    like `'0' + number` or `number + '.0'`, so anything else must be
+    turned away before it reaches caches, locks or the ledger.
+    """
+    return (isinstance(number, str) and len(number) == CARD_NUMBER_LENGTH
+            and number.isascii() and number.isdigit() and number[0] != '0')
+
+
+def get_pins(count):
+    """Draw `count` random 4-digit PINs at once."""
+    return [f'{pin:04d}' for pin in random.choices(range(10000), k=count)]
+
+
+def allocate_numbers(connection, count, issuer_num=ISSUER_NUM):
+    """Allocate `count` unused card numbers for an issuer.
+
+    Args:
+        connection (obj): Connection object
+        count (int): number of card numbers to be allocated
+        issuer_num (str): Bank Identification Number
+
+    Returns:
+        list: complete card numbers, never issued before
+    """
+    numbers = []
+    while len(numbers) < count:
+        needed = count - len(numbers)
+        key, start = database.reserve_account_ids(
+            connection, issuer_num, needed, secrets.randbits(63)
+        )
+        if start + needed > ACCOUNT_ID_SPACE:
+            raise OverflowError(f'Account numbers exhausted for {issuer_num}')
+
+        permutation = AccountIdPermutation(key)
+        candidates = luhn.complete_batch([
+            f'{issuer_num}{permutation[index]:09d}'
+            for index in range(start, start + needed)
+        ])
+
+        # Skip numbers issued one at a time by random draws
+        existing = database.get_existing_numbers(connection, candidates)
+        numbers.extend(num for num in candidates if num not in existing)
+
+    return numbers
+
+
+def issue_cards(connection, count, issuer_num=ISSUER_NUM, pin_hasher=None,
+                plaintext_pins=False, max_workers=None):
+    """Create `count` new cards and add them in a single transaction.
+
+    Hashing dominates the cost: default scrypt takes about 65 ms of CPU
+    per PIN, so PINs are hashed in a process pool, which still takes
+    roughly 17 CPU-hours per million cards.
+
+    Args:
+        connection (obj): Connection object
+        count (int): number of cards to be issued
+        issuer_num (str): Bank Identification Number
+        pin_hasher (PinHasher): hasher of the stored PINs, scrypt by
+            default
+        plaintext_pins (bool): store plaintext PINs instead, which keeps
+            bulk issuance fast; they must be hashed later with
+            `pins.migrate_plaintext_pins`
+        max_workers (int): number of hashing processes, one per CPU by
+            default
+
+    Returns:
+        list: (number, pin) pairs of the issued cards, with plaintext PINs
+    """
+    # Sorted numbers are inserted in index order, which keeps page splits
+    # of the UNIQUE index local
+    numbers = sorted(allocate_numbers(connection, count, issuer_num))
+    cards = list(zip(numbers, get_pins(count)))
+
+    if plaintext_pins:
+        database.add_cards(connection, cards)
+    else:
+        hashes = pins.hash_pins([pin for _, pin in cards], pin_hasher,
+                                max_workers)
+        database.add_cards(connection, list(zip(numbers, hashes)))
+
+    return cards
@@ -0,0 +1,50 @@
+"""
+Per-account locks for services shared by many threads.
+
+SQLite already makes every transfer atomic, but it serializes all writers
+of a database and lets the losers spin in its busy handler. A LockManager
+keeps threads of one process working on the same accounts in line before
+they reach SQLite, while operations on unrelated accounts run in parallel.
+"""
+import threading
+from contextlib import contextmanager
+
+
+class LockManager:
+    """Striped locks keyed by card number.
+
+    Numbers are hashed onto a fixed number of stripes, so memory stays
+    constant however many accounts there are; two accounts sharing a stripe
+    merely wait for each other. Locks of several accounts are always taken
+    in stripe order, which rules out deadlocks between opposite transfers.
+    """
+
+    def __init__(self, stripes=1024):
+        """Initialize the stripes.
+
+        Args:
+            stripes (int): number of underlying locks
+        """
+        self.stripes = [threading.Lock() for _ in range(stripes)]
+
+    def _stripe_indices(self, numbers):
+        return sorted({hash(number) % len(self.stripes)
+                       for number in numbers})
+
+    @contextmanager
+    def lock(self, *numbers):
+        """Hold the locks of all given accounts.
+
+        Args:
+            numbers (str): card numbers, duplicates are allowed
+        """
+        locks = [self.stripes[i] for i in self._stripe_indices(numbers)]
+        acquired = []
+        try:
+            for lock in locks:
+                lock.acquire()
+                acquired.append(lock)
+            yield
+        finally:
+            for lock in reversed(acquired):
+                lock.release()
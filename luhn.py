@@ -0,0 +1,166 @@
+"""
+Table-driven Luhn algorithm for single card numbers and whole batches.
+"""
+# Contribution of a digit character (byte) to the Luhn sum, depending on
+# whether the digit sits on a doubled position or not
+_DIGITS = b'0123456789'
+_PLAIN = bytes.maketrans(_DIGITS, bytes(range(10)))
+_DOUBLED = bytes.maketrans(_DIGITS, bytes([0, 2, 4, 6, 8, 1, 3, 5, 7, 9]))
+
+# Map a Luhn sum (0-255) to a validity flag or to the missing check digit
+_IS_VALID = bytes(1 if total % 10 == 0 else 0 for total in range(256))
+_CHECK_DIGIT = bytes(_DIGITS[-total % 10] for total in range(256))
+
+# Batches are summed byte-wise without carries, so every number's digit sum
+# has to fit into a single byte (28 digits * 9 = 252)
+_MAX_BATCH_LENGTH = 28
+
+
+def _is_digits(number):
+    return number.isascii() and number.isdigit()
+
+
+def _luhn_sum(digits, check_digit_included=True):
+    """Return the Luhn sum of an ASCII digit string.
+
+    Args:
+        digits (bytes): card number digits
+        check_digit_included (bool): whether the last digit is a check digit
+
+    Returns:
+        int: sum of the plain and doubled digits
+    """
+    if check_digit_included:
+        plain, doubled = digits[-1::-2], digits[-2::-2]
+    else:
+        plain, doubled = digits[-2::-2], digits[-1::-2]
+
+    return sum(plain.translate(_PLAIN)) + sum(doubled.translate(_DOUBLED))
+
+
+def is_valid(number):
+    """Check that the card number passes Luhn algorithm.
+
+    Args:
+        number (str): card number including its check digit
+
+    Returns:
+        bool: True if the number is valid, False otherwise
+    """
+    number = str(number)
+    if not number or not _is_digits(number):
+        return False
+
+    return _luhn_sum(number.encode()) % 10 == 0
+
+
+def check_digit(partial):
+    """Find the check digit completing a card number.
+
+    Args:
+        partial (str): card number without its check digit
+
+    Returns:
+        str: single check digit
+    """
+    return chr(_DIGITS[-_luhn_sum(partial.encode(), False) % 10])
+
+
+def _column_sums(blob, length, check_digit_included):
+    """Sum the digits of equally long numbers stored back to back.
+
+    Every number's Luhn sum ends up in its own byte of the result. Each
+    column (n-th digit of every number) is translated at once and the
+    columns are added as big integers, which is safe because no byte can
+    overflow into its neighbour.
+
+    Args:
+        blob (bytes): concatenated numbers
+        length (int): length of each number
+        check_digit_included (bool): whether the last digit is a check digit
+
+    Returns:
+        bytes: one Luhn sum per number
+    """
+    count = len(blob) // length
+    total = 0
+    for position in range(length):
+        from_right = length - position - check_digit_included
+        table = _DOUBLED if from_right % 2 == 1 else _PLAIN
+        column = blob[position::length].translate(table)
+        total += int.from_bytes(column, 'big')
+
+    return total.to_bytes(count, 'big')
+
+
+def _as_batch(numbers):
+    """Join numbers into one ASCII blob if they can be summed column-wise.
+
+    Args:
+        numbers (list): card numbers as strings
+
+    Returns:
+        tuple: (blob, length) or None if the slow path has to be used
+    """
+    if not numbers:
+        return None
+
+    length = len(numbers[0])
+    if (not 0 < length <= _MAX_BATCH_LENGTH
+            or any(len(number) != length for number in numbers)):
+        return None
+
+    blob = ''.join(numbers)
+    if not _is_digits(blob):
+        return None
+
+    return blob.encode(), length
+
+
+def validate_batch(numbers):
+    """Check a batch of card numbers against Luhn algorithm.
+
+    Numbers of equal length are validated in a single vectorized pass,
+    any other input falls back to validating numbers one by one. Numbers
+    may be given as strings or integers.
+
+    Args:
+        numbers (iterable): card numbers, e.g. a list or a NumPy array
+
+    Returns:
+        list: boolean mask, or a NumPy bool array for NumPy input
+    """
+    as_array = hasattr(numbers, 'dtype')
+    numbers = [str(number) for number in numbers]
+    batch = _as_batch(numbers)
+
+    if batch is None:
+        mask = bytes(is_valid(number) for number in numbers)
+    else:
+        blob, length = batch
+        mask = _column_sums(blob, length, True).translate(_IS_VALID)
+
+    if as_array:
+        import numpy
+        return numpy.frombuffer(mask, dtype=bool).copy()
+    return [bool(flag) for flag in mask]
+
+
+def complete_batch(partials):
+    """Append Luhn check digits to a batch of partial card numbers.
+
+    Args:
+        partials (iterable): equally long card numbers without check digits
+
+    Returns:
+        list: complete card numbers
+    """
+    partials = [str(partial) for partial in partials]
+    batch = _as_batch(partials)
+
+    if batch is None:
+        return [partial + check_digit(partial) for partial in partials]
+
+    blob, length = batch
+    digits = _column_sums(blob, length, False).translate(_CHECK_DIGIT)
+    return [partial + chr(digit) for partial, digit in zip(partials, digits)]
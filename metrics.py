@@ -0,0 +1,297 @@
+"""
+Per-operation latency histograms and counters.
+
+Instrumentation is switched on with `enable()`, which wraps the public
+functions of the database and banking modules and the public methods of
+BankService, BankingSystem and Account in timers. Until then nothing is
+wrapped and there is no overhead at all; `disable()` restores the
+original functions.
+
+Generators and context managers like `database.iter_cards` aren't timed:
+calling them returns at once, their work happens while they are consumed.
+
+Collected metrics are exposed in Prometheus text format by `serve()` or
+written as JSON snapshots by `SnapshotWriter`.
+"""
+import functools
+import inspect
+import json
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import banking
+import database
+import service
+
+
+# Every power of two is split into 2 ** SUB_BUCKET_BITS buckets, which
+# bounds the relative error of a recorded value to 1 / 8
+SUB_BUCKET_BITS = 3
+_SUB_BUCKETS = 1 << SUB_BUCKET_BITS
+_LINEAR_LIMIT = 2 * _SUB_BUCKETS
+
+# Bucket bounds in seconds used for the Prometheus export
+PROMETHEUS_BUCKETS = (
+    0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005,
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10,
+)
+
+
+def _bucket_index(value):
+    """Map a non-negative integer to its log-linear bucket."""
+    if value < _LINEAR_LIMIT:
+        return value
+
+    shift = value.bit_length() - SUB_BUCKET_BITS - 1
+    sub_bucket = (value >> shift) - _SUB_BUCKETS
+    return _LINEAR_LIMIT + (shift - 1) * _SUB_BUCKETS + sub_bucket
+
+
+def _bucket_upper_bound(index):
+    """Return the largest value falling into a bucket."""
+    if index < _LINEAR_LIMIT:
+        return index
+
+    shift, sub_bucket = divmod(index - _LINEAR_LIMIT, _SUB_BUCKETS)
+    shift += 1
+    return ((_SUB_BUCKETS + sub_bucket + 1) << shift) - 1
+
+
+class Histogram:
+    """HDR-style histogram of durations in nanoseconds."""
+
+    def __init__(self):
+        self.counts = {}
+        self.count = 0
+        self.total = 0
+        self.max = 0
+        self.errors = 0
+        self._lock = threading.Lock()
+
+    def record(self, value):
+        index = _bucket_index(value)
+        with self._lock:
+            self.counts[index] = self.counts.get(index, 0) + 1
+            self.count += 1
+            self.total += value
+            if value > self.max:
+                self.max = value
+
+    def record_error(self):
+        with self._lock:
+            self.errors += 1
+
+    def percentile(self, fraction):
+        """Return the upper bound of the bucket holding the percentile."""
+        with self._lock:
+            counts = sorted(self.counts.items())
+            rank = fraction * self.count
+
+        seen = 0
+        for index, hits in counts:
+            seen += hits
+            if seen >= rank:
+                return min(_bucket_upper_bound(index), self.max)
+        return 0
+
+    def cumulative(self, bounds):
+        """Count values up to each bound, bounds given in nanoseconds."""
+        with self._lock:
+            counts = sorted(self.counts.items())
+
+        result = []
+        seen = 0
+        buckets = iter(counts)
+        pending = next(buckets, None)
+        for bound in bounds:
+            while (pending is not None
+                   and _bucket_upper_bound(pending[0]) <= bound):
+                seen += pending[1]
+                pending = next(buckets, None)
+            result.append(seen)
+        return result
+
+
+class Registry:
+    """Histograms by operation name."""
+
+    def __init__(self):
+        self.histograms = {}
+        self._lock = threading.Lock()
+
+    def histogram(self, name):
+        with self._lock:
+            return self.histograms.setdefault(name, Histogram())
+
+    def reset(self):
+        with self._lock:
+            self.histograms.clear()
+
+    def snapshot(self):
+        """Summarize all operations, durations in seconds."""
+        snapshot = {}
+        for name, histogram in sorted(self.histograms.items()):
+            snapshot[name] = {
+                'count': histogram.count,
+                'errors': histogram.errors,
+                'sum': histogram.total / 1e9,
+                'p50': histogram.percentile(0.50) / 1e9,
+                'p90': histogram.percentile(0.90) / 1e9,
+                'p99': histogram.percentile(0.99) / 1e9,
+                'max': histogram.max / 1e9,
+            }
+        return snapshot
+
+    def prometheus(self):
+        """Render all operations in Prometheus text exposition format."""
+        lines = [
+            '# HELP bank_operation_duration_seconds Duration of operations.',
+            '# TYPE bank_operation_duration_seconds histogram',
+        ]
+        bounds = [round(bound * 1e9) for bound in PROMETHEUS_BUCKETS]
+        for name, histogram in sorted(self.histograms.items()):
+            label = f'operation="{name}"'
+            cumulative = histogram.cumulative(bounds)
+            for bound, seen in zip(PROMETHEUS_BUCKETS, cumulative):
+                lines.append(f'bank_operation_duration_seconds_bucket'
+                             f'{{{label},le="{bound}"}} {seen}')
+            lines.append(f'bank_operation_duration_seconds_bucket'
+                         f'{{{label},le="+Inf"}} {histogram.count}')
+            lines.append(f'bank_operation_duration_seconds_sum{{{label}}} '
+                         f'{histogram.total / 1e9}')
+            lines.append(f'bank_operation_duration_seconds_count{{{label}}} '
+                         f'{histogram.count}')
+
+        lines += [
+            '# HELP bank_operation_errors_total Operations that raised.',
+            '# TYPE bank_operation_errors_total counter',
+        ]
+        for name, histogram in sorted(self.histograms.items()):
+            lines.append(f'bank_operation_errors_total'
+                         f'{{operation="{name}"}} {histogram.errors}')
+
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+# (owner, attribute name, original function) of every installed wrapper
+_installed = []
+
+# Interactive loops whose duration is the user's session, not an operation
+_SKIPPED = {'menu', 'main'}
+
+
+def _is_timed(name, func):
+    return (inspect.isfunction(func) and not name.startswith('_')
+            and name not in _SKIPPED
+            and not inspect.isgeneratorfunction(inspect.unwrap(func)))
+
+
+def _timed(name, func):
+    histogram = registry.histogram(name)
+    perf_counter_ns = time.perf_counter_ns
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        start = perf_counter_ns()
+        try:
+            return func(*args, **kwargs)
+        except Exception:
+            histogram.record_error()
+            raise
+        finally:
+            histogram.record(perf_counter_ns() - start)
+
+    return wrapper
+
+
+def _targets():
+    """Yield (owner, attribute name, operation name) to be instrumented."""
+    for module in (database, banking):
+        for name, func in vars(module).items():
+            if _is_timed(name, func) and func.__module__ == module.__name__:
+                yield module, name, f'{module.__name__}.{name}'
+
+    for cls in (service.BankService, banking.BankingSystem, banking.Account):
+        for name, func in vars(cls).items():
+            if _is_timed(name, func):
+                yield cls, name, f'{cls.__name__}.{name}'
+
+
+def enable():
+    """Wrap all instrumented operations in timers."""
+    if _installed:
+        return
+
+    for owner, name, operation in list(_targets()):
+        func = getattr(owner, name)
+        _installed.append((owner, name, func))
+        setattr(owner, name, _timed(operation, func))
+
+
+def disable():
+    """Restore the original, uninstrumented operations."""
+    while _installed:
+        owner, name, func = _installed.pop()
+        setattr(owner, name, func)
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if self.path != '/metrics':
+            self.send_error(404)
+            return
+
+        body = registry.prometheus().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(host='127.0.0.1', port=9100):
+    """Expose /metrics over HTTP from a background thread.
+
+    Returns:
+        ThreadingHTTPServer: the running server, stop it with shutdown()
+    """
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    threading.Thread(target=server.serve_forever, name='bank-metrics',
+                     daemon=True).start()
+    return server
+
+
+class SnapshotWriter(threading.Thread):
+    """Periodically writes `registry.snapshot()` to a JSON file."""
+
+    def __init__(self, filepath, interval=10):
+        super().__init__(name='bank-metrics-snapshot', daemon=True)
+        self.filepath = filepath
+        self.interval = interval
+        self._stopped = threading.Event()
+
+    def write(self):
+        """Replace the snapshot file atomically."""
+        snapshot = {'timestamp': time.time(),
+                    'operations': registry.snapshot()}
+        temp_filepath = f'{self.filepath}.tmp'
+        with open(temp_filepath, 'w') as f:
+            json.dump(snapshot, f, indent=2)
+        os.replace(temp_filepath, self.filepath)
+
+    def run(self):
+        while not self._stopped.wait(self.interval):
+            self.write()
+        self.write()
+
+    def stop(self):
+        self._stopped.set()
+        self.join()
@@ -0,0 +1,63 @@
+"""
+Schema migrations of an existing banking database.
+
+Usage:
+    python migrate.py integer-numbers [--db PATH] [--vacuum]
+    python migrate.py hash-pins [--db PATH] [--kdf scrypt] [--workers N]
+"""
+import argparse
+
+import database
+import pins
+
+
+DB_FILEPATH = 'card.s3db'
+
+
+def integer_numbers(connection, args):
+    """Store card numbers as 64-bit integers."""
+    database.create_table(connection)
+    if not database.migrate_to_integer_numbers(connection):
+        print('Card numbers are already stored as integers.')
+        return
+
+    print('Card numbers are now stored as integers.')
+    if args.vacuum:
+        connection.execute('VACUUM;')
+
+
+def hash_pins(connection, args):
+    """Replace plaintext PINs by salted hashes."""
+    database.create_table(connection)
+    hasher = pins.PinHasher(args.kdf)
+    migrated = pins.migrate_plaintext_pins(connection, hasher, args.workers)
+    print(f'{migrated} PINs hashed.')
+
+
+MIGRATIONS = {
+    'integer-numbers': integer_numbers,
+    'hash-pins': hash_pins,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Migrate a database')
+    parser.add_argument('migration', choices=MIGRATIONS)
+    parser.add_argument('--db', default=DB_FILEPATH)
+    parser.add_argument('--vacuum', action='store_true',
+                        help='compact the database file afterwards')
+    parser.add_argument('--kdf', choices=['scrypt', 'pbkdf2_sha256'],
+                        default='scrypt', help='KDF of hashed PINs')
+    parser.add_argument('--workers', type=int,
+                        help='processes hashing PINs, one per CPU by default')
+    args = parser.parse_args()
+
+    connection = database.connect(args.db)
+    try:
+        MIGRATIONS[args.migration](connection, args)
+    finally:
+        connection.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,262 @@
+"""
+Salted PIN hashing with a tunable key derivation function.
+
+Hashes are stored as `$`-separated strings naming the KDF and its
+parameters, e.g. `scrypt$16384$8$1$<salt>$<hash>`, so the KDF can be
+retuned without invalidating stored PINs. PINs stored in plaintext by
+earlier versions are still accepted by `verify_pin` until they are
+migrated with `migrate_plaintext_pins`.
+"""
+import base64
+import hashlib
+import hmac
+import os
+import secrets
+import threading
+
+import database
+from cache import LRUCache
+
+
+SALT_SIZE = 16
+
+# Number of `$`-separated parameters of every supported KDF
+_PARAM_COUNTS = {'scrypt': 3, 'pbkdf2_sha256': 1}
+
+
+def _encode(data):
+    return base64.b64encode(data).decode()
+
+
+def _decode(text):
+    return base64.b64decode(text)
+
+
+class PinHasher:
+    """Hashes PINs with scrypt or PBKDF2-HMAC-SHA256."""
+
+    def __init__(self, method='scrypt', n=2 ** 14, r=8, p=1,
+                 iterations=600_000):
+        """Initialize the hasher.
+
+        Args:
+            method (str): 'scrypt' or 'pbkdf2_sha256'
+            n (int): scrypt CPU/memory cost
+            r (int): scrypt block size
+            p (int): scrypt parallelization
+            iterations (int): PBKDF2 iteration count
+        """
+        if method not in _PARAM_COUNTS:
+            raise ValueError(f'Unknown KDF: {method}')
+
+        self.method = method
+        self.params = (n, r, p) if method == 'scrypt' else (iterations,)
+        self._dummy_hash = None
+
+    def hash(self, pin):
+        """Return the storable hash of a PIN."""
+        salt = os.urandom(SALT_SIZE)
+        digest = _derive(self.method, self.params, pin, salt)
+        params = '$'.join(map(str, self.params))
+        return f'{self.method}${params}${_encode(salt)}${_encode(digest)}'
+
+    def dummy_hash(self):
+        """Return a hash that no PIN matches.
+
+        Logins for unknown cards are checked against it, so they take as
+        long as logins with a wrong PIN and don't tell which cards exist.
+        """
+        if self._dummy_hash is None:
+            self._dummy_hash = self.hash(secrets.token_hex(16))
+        return self._dummy_hash
+
+
+def _derive(method, params, pin, salt):
+    if method == 'scrypt':
+        n, r, p = params
+        return hashlib.scrypt(pin.encode(), salt=salt, n=n, r=r, p=p,
+                              maxmem=2 * 128 * n * r * p)
+    if method == 'pbkdf2_sha256':
+        iterations, = params
+        return hashlib.pbkdf2_hmac('sha256', pin.encode(), salt, iterations)
+
+    raise ValueError(f'Unknown KDF: {method}')
+
+
+def is_hashed(stored):
+    return '$' in stored
+
+
+def is_well_formed(stored):
+    """Check that a hashed PIN parses as `method$params$salt$hash`."""
+    method, *params = stored.split('$')
+    if method not in _PARAM_COUNTS or len(params) != _PARAM_COUNTS[method] + 2:
+        return False
+
+    *params, salt, digest = params
+    if not all(param.isascii() and param.isdigit() and int(param) > 0
+               for param in params):
+        return False
+
+    try:
+        return bool(base64.b64decode(salt, validate=True)
+                    and base64.b64decode(digest, validate=True))
+    except ValueError:
+        return False
+
+
+def verify_pin(pin, stored):
+    """Check a PIN against its stored hash, or legacy plaintext PIN.
+
+    The final comparison takes constant time.
+    """
+    if not is_hashed(stored):
+        return hmac.compare_digest(pin.encode(), stored.encode())
+
+    try:
+        method, *params, salt, digest = stored.split('$')
+        derived = _derive(method, tuple(map(int, params)), pin, _decode(salt))
+        expected = _decode(digest)
+    except ValueError:
+        return False
+
+    return hmac.compare_digest(derived, expected)
+
+
+class PinVerifier:
+    """Verifies PINs in a process pool with a cache of recent sessions.
+
+    The KDF is CPU-heavy by design, so it runs in worker processes and at
+    most `max_pending` verifications or hashes of new PINs are in flight;
+    further requests wait for a slot instead of piling up work. Successful
+    verifications are remembered for `session_ttl` seconds under a keyed
+    digest of the card number, PIN and stored hash, so plaintext PINs
+    aren't kept in memory and a changed PIN hash misses the cache.
+    """
+
+    def __init__(self, max_workers=None, max_pending=None,
+                 session_size=10000, session_ttl=300):
+        # Imported here, most importers of this module only hash or verify
+        from concurrent.futures import ProcessPoolExecutor
+
+        max_workers = max_workers or os.cpu_count() or 1
+        max_pending = max_pending or 2 * max_workers
+        self.executor = ProcessPoolExecutor(max_workers)
+        self.max_pending = max_pending
+        self.sessions = LRUCache(session_size, session_ttl)
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._async_slots = None
+        self._secret = secrets.token_bytes(32)
+
+    def _session_key(self, number, pin, stored):
+        message = '\0'.join((number, pin, stored)).encode()
+        return hmac.new(self._secret, message, hashlib.sha256).digest()
+
+    def _remember(self, key, verified):
+        if verified:
+            self.sessions.put(key, True)
+        return verified
+
+    def verify(self, number, pin, stored):
+        """Check a PIN, blocking the calling thread."""
+        key = self._session_key(number, pin, stored)
+        if self.sessions.get(key):
+            return True
+
+        with self._slots:
+            future = self.executor.submit(verify_pin, pin, stored)
+            return self._remember(key, future.result())
+
+    async def averify(self, number, pin, stored):
+        """Check a PIN without blocking the event loop."""
+        import asyncio
+
+        key = self._session_key(number, pin, stored)
+        if self.sessions.get(key):
+            return True
+
+        if self._async_slots is None:
+            self._async_slots = asyncio.Semaphore(self.max_pending)
+
+        loop = asyncio.get_running_loop()
+        async with self._async_slots:
+            verified = await loop.run_in_executor(self.executor, verify_pin,
+                                                  pin, stored)
+        return self._remember(key, verified)
+
+    def hash(self, hasher, pin):
+        """Hash a new PIN with a PinHasher, blocking the calling thread."""
+        with self._slots:
+            return self.executor.submit(hasher.hash, pin).result()
+
+    async def ahash(self, hasher, pin):
+        """Hash a new PIN without blocking the event loop."""
+        import asyncio
+
+        if self._async_slots is None:
+            self._async_slots = asyncio.Semaphore(self.max_pending)
+
+        loop = asyncio.get_running_loop()
+        async with self._async_slots:
+            return await loop.run_in_executor(self.executor, hasher.hash, pin)
+
+    def close(self):
+        self.executor.shutdown()
+
+
+def hash_pins(plain, hasher=None, max_workers=None):
+    """Hash many new PINs in a process pool.
+
+    Args:
+        plain (list): plaintext PINs
+        hasher (PinHasher): hasher of the PINs, scrypt by default
+        max_workers (int): number of worker processes, one per CPU by
+            default
+
+    Returns:
+        list: hashes in the order of `plain`
+    """
+    from concurrent.futures import ProcessPoolExecutor
+
+    hasher = hasher or PinHasher()
+    with ProcessPoolExecutor(max_workers) as executor:
+        return list(executor.map(hasher.hash, plain, chunksize=16))
+
+
+def migrate_plaintext_pins(connection, hasher=None, max_workers=None,
+                           batch_size=1000):
+    """Replace plaintext PINs in the database by their hashes.
+
+    Hashes are computed in a process pool and written batch by batch; a
+    PIN changed in the meantime is left alone.
+
+    Returns:
+        int: number of PINs hashed
+    """
+    from concurrent.futures import ProcessPoolExecutor
+
+    hasher = hasher or PinHasher()
+    migrated = 0
+    with ProcessPoolExecutor(max_workers) as executor:
+        batch = []
+        rows = database.iter_cards(connection, batch_size, with_id=True)
+        for card_id, _, pin, _ in rows:
+            if not is_hashed(pin):
+                batch.append((card_id, pin))
+            if len(batch) == batch_size:
+                migrated += _hash_batch(connection, hasher, executor, batch)
+                batch = []
+
+        if batch:
+            migrated += _hash_batch(connection, hasher, executor, batch)
+
+    return migrated
+
+
+def _hash_batch(connection, hasher, executor, batch):
+    hashes = executor.map(hasher.hash, [pin for _, pin in batch],
+                          chunksize=16)
+    return database.update_pins(connection, [
+        (hashed, card_id, pin)
+        for (card_id, pin), hashed in zip(batch, hashes)
+    ])
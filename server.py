@@ -0,0 +1,364 @@
+"""
+Asyncio network front-end of the banking system.
+
+Clients talk a line protocol: every request is a JSON object on its own
+line, e.g. {"op": "login", "number": "...", "pin": "..."}, and gets exactly
+one JSON line back, either {"ok": true, ...} or
+{"ok": false, "error": "<error type>", "message": "..."}.
+
+Supported operations: create_account, login, balance, deposit, transfer,
+transfer_batch, close_account and logout. All but the first two need a
+logged in session. A transfer_batch request carries a "transfers" list of
+{"receiver": "...", "amount": ...} objects and gets the outcome of each.
+Deposits and transfers may carry an "idempotency_key": a retry with the
+same key gets the original response instead of moving the money again.
+
+Database work runs on a bounded thread pool, each worker thread using its
+own WAL-mode connection from a ConnectionPool, so the event loop never
+waits on disk I/O. PINs are hashed and verified in a separate process
+pool.
+
+Usage:
+    python server.py [--host HOST] [--port PORT] [--db PATH] [--workers N]
+"""
+import argparse
+import asyncio
+import json
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+import database
+import issuance
+from bloom import BloomFilter
+from cache import LRUCache
+from groupcommit import GroupCommitWriter
+from locks import LockManager
+from pins import PinHasher, PinVerifier
+from service import (
+    MAX_AMOUNT, BankError, BankService, CardNotFoundError,
+    InvalidAmountError, WrongCredentialsError
+)
+
+
+DB_FILEPATH = 'card.s3db'
+# Fits a transfer_batch of some 50,000 payments
+MAX_LINE = 8 * 1024 * 1024
+
+
+class RequestError(Exception):
+    """Malformed request or an operation not allowed in the session."""
+
+
+class Session:
+    """State of a single client connection."""
+
+    def __init__(self):
+        self.number = None
+
+    def require_login(self):
+        if self.number is None:
+            raise RequestError('You are not logged in!')
+        return self.number
+
+
+def _get_integer(request, field):
+    value = request.get(field)
+    if type(value) is not int:
+        raise RequestError(f'{field.capitalize()} must be an integer!')
+    return value
+
+
+def _get_amount(request):
+    amount = _get_integer(request, 'amount')
+    if not 0 < amount <= MAX_AMOUNT:
+        raise InvalidAmountError(f'Amount must be between 1 and '
+                                 f'{MAX_AMOUNT:,}!')
+    return amount
+
+
+def _get_text(request, field):
+    value = request.get(field)
+    if not isinstance(value, str):
+        raise RequestError(f'Missing field: {field}')
+    return value
+
+
+def _get_key(request):
+    key = request.get('idempotency_key')
+    if key is not None and not (isinstance(key, str) and 0 < len(key) <= 255):
+        raise RequestError('Idempotency key must be a string of 1-255 '
+                           'characters!')
+    return key
+
+
+class BankServer:
+    """Serves BankService operations to many concurrent clients."""
+
+    def __init__(self, db_filepath=DB_FILEPATH, max_workers=8,
+                 max_pending=1024, cache_size=100_000, cache_ttl=60,
+                 group_commit=False, results_size=100_000,
+                 max_line=MAX_LINE, card_filter=False):
+        """Initialize the server.
+
+        Args:
+            db_filepath (str): path to database file
+            max_workers (int): number of threads executing database calls
+            max_pending (int): maximum number of database calls waiting
+                for a worker, further requests wait on the event loop
+            cache_size (int): number of cards kept in memory, 0 disables
+                the cache
+            cache_ttl (float): seconds a cached card is trusted, bounds
+                staleness if other processes write to the database
+            group_commit (bool): whether deposits and transfers of all
+                workers are batched into shared transactions
+            results_size (int): number of recent results of requests with
+                an idempotency key kept in memory, 0 disables the cache
+            max_line (int): maximum size of a request line in bytes
+            card_filter (bool): whether lookups of unknown card numbers
+                are answered by a Bloom filter; only safe while no other
+                process creates cards in the database
+        """
+        self.db_filepath = db_filepath
+        self.max_pending = max_pending
+        self.max_line = max_line
+        self.executor = ThreadPoolExecutor(max_workers,
+                                           thread_name_prefix='bank-db')
+        self.pool = database.ConnectionPool(db_filepath)
+        self.cache = LRUCache(cache_size, cache_ttl) if cache_size else None
+        self.use_card_filter = card_filter
+        self.card_filter = None
+        self.writer = GroupCommitWriter(self.pool) if group_commit else None
+        self.locks = LockManager()
+        self.results = LRUCache(results_size) if results_size else None
+        self.pin_hasher = PinHasher()
+        self.pin_verifier = PinVerifier()
+        self._pending = None
+        self.operations = {
+            'create_account': self.create_account,
+            'login': self.login,
+            'balance': self.balance,
+            'deposit': self.deposit,
+            'transfer': self.transfer,
+            'transfer_batch': self.transfer_batch,
+            'close_account': self.close_account,
+            'logout': self.logout,
+        }
+
+    def _execute(self, method, args):
+        with self.pool.connection() as connection:
+            service = BankService(connection, self.cache, self.card_filter,
+                                  self.writer, locks=self.locks,
+                                  results=self.results)
+            return getattr(service, method)(*args)
+
+    async def call(self, method, *args):
+        """Run a BankService method on the worker pool."""
+        loop = asyncio.get_running_loop()
+        async with self._pending:
+            return await loop.run_in_executor(
+                self.executor, self._execute, method, args
+            )
+
+    async def create_account(self, session, request):
+        # The KDF runs in the process pool, no database worker waits on it
+        pin, = issuance.get_pins(1)
+        pin_hash = await self.pin_verifier.ahash(self.pin_hasher, pin)
+        card = await self.call('create_account', pin, pin_hash)
+        return {'number': card.number, 'pin': card.pin}
+
+    async def login(self, session, request):
+        number = _get_text(request, 'number')
+        pin = _get_text(request, 'pin')
+        try:
+            card = await self.call('get_card', number)
+            stored = card.pin
+        except CardNotFoundError:
+            card = None
+            stored = self.pin_hasher.dummy_hash()
+
+        # The KDF runs in the process pool, no database worker waits on it
+        verified = await self.pin_verifier.averify(number, pin, stored)
+        if card is None or not verified:
+            raise WrongCredentialsError
+
+        session.number = card.number
+        return {'number': card.number, 'balance': card.balance}
+
+    async def balance(self, session, request):
+        number = session.require_login()
+        return {'balance': await self.call('get_balance', number)}
+
+    async def deposit(self, session, request):
+        number = session.require_login()
+        balance = await self.call('add_income', number, _get_amount(request),
+                                  _get_key(request))
+        return {'balance': balance}
+
+    async def transfer(self, session, request):
+        number = session.require_login()
+        transfer = await self.call('transfer_money', number,
+                                   _get_text(request, 'receiver'),
+                                   _get_amount(request), _get_key(request))
+        return {'balance': transfer.balance}
+
+    async def transfer_batch(self, session, request):
+        number = session.require_login()
+        transfers = request.get('transfers')
+        if not isinstance(transfers, list) or not all(
+                isinstance(item, dict) for item in transfers):
+            raise RequestError('Transfers must be a list of objects!')
+
+        # Amounts are checked per item by the service
+        items = [(_get_text(item, 'receiver'), _get_integer(item, 'amount'))
+                 for item in transfers]
+        batch = await self.call('transfer_batch', number, items)
+        return {
+            'balance': batch.balance,
+            'total': batch.total,
+            'results': [
+                {'ok': True} if item.error is None else
+                {'ok': False, 'error': type(item.error).__name__,
+                 'message': str(item.error)}
+                for item in batch.items
+            ],
+        }
+
+    async def close_account(self, session, request):
+        number = session.require_login()
+        await self.call('delete_account', number)
+        session.number = None
+        return {}
+
+    async def logout(self, session, request):
+        session.require_login()
+        session.number = None
+        return {}
+
+    async def dispatch(self, session, line):
+        """Execute a single request line and build its response."""
+        try:
+            request = json.loads(line)
+            if not isinstance(request, dict):
+                raise RequestError('Request must be a JSON object')
+
+            op = request.get('op')
+            if not isinstance(op, str):
+                raise RequestError('Operation must be a string')
+            operation = self.operations.get(op)
+            if operation is None:
+                raise RequestError(f'Unknown operation: {op}')
+
+            result = await operation(session, request)
+        except (BankError, RequestError) as e:
+            return {'ok': False, 'error': type(e).__name__, 'message': str(e)}
+        except ValueError as e:
+            return {'ok': False, 'error': 'RequestError', 'message': str(e)}
+        except database.Error as e:
+            return {'ok': False, 'error': 'DatabaseError', 'message': str(e)}
+        except Exception:
+            # The client still gets its answer, the details go to the log
+            logging.getLogger(__name__).exception('Request failed')
+            return {'ok': False, 'error': 'InternalError',
+                    'message': 'Internal server error'}
+
+        return {'ok': True, **result}
+
+    @staticmethod
+    async def _respond(writer, response):
+        writer.write(json.dumps(response).encode() + b'\n')
+        await writer.drain()
+
+    async def handle_client(self, reader, writer):
+        """Serve one client connection until it disconnects."""
+        session = Session()
+        try:
+            while True:
+                try:
+                    line = await reader.readline()
+                except (asyncio.LimitOverrunError, ValueError):
+                    # The rest of the oversized line can't be told apart
+                    # from the next request, so the connection ends here
+                    await self._respond(writer, {
+                        'ok': False, 'error': 'RequestError',
+                        'message': f'Request exceeds {self.max_line:,} bytes',
+                    })
+                    break
+                if not line:
+                    break
+
+                await self._respond(writer, await self.dispatch(session, line))
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host='127.0.0.1', port=8888):
+        """Listen for clients until cancelled."""
+        with self.pool.connection() as connection:
+            database.create_table(connection)
+            if self.use_card_filter:
+                self.card_filter = BloomFilter.from_connection(connection)
+
+        # Logins for unknown cards need it, computed before any client waits
+        self.pin_hasher.dummy_hash()
+
+        self._pending = asyncio.Semaphore(self.max_pending)
+        server = await asyncio.start_server(self.handle_client, host, port,
+                                            backlog=4096,
+                                            limit=self.max_line)
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            self.executor.shutdown(wait=True)
+            if self.writer is not None:
+                self.writer.close()
+            self.pin_verifier.close()
+            self.pool.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Banking system server')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8888)
+    parser.add_argument('--db', default=DB_FILEPATH)
+    parser.add_argument('--workers', type=int, default=8)
+    parser.add_argument('--group-commit', action='store_true',
+                        help='batch deposits and transfers into shared '
+                             'transactions')
+    parser.add_argument('--card-filter', action='store_true',
+                        help='answer lookups of unknown cards from a Bloom '
+                             'filter, only if no other process creates cards')
+    parser.add_argument('--metrics-port', type=int,
+                        help='serve Prometheus metrics on this port')
+    parser.add_argument('--metrics-file',
+                        help='write metric snapshots to this JSON file')
+    parser.add_argument('--slow-query-ms', type=float,
+                        help='log statements slower than this and the '
+                             'query plan of every statement')
+    args = parser.parse_args()
+
+    if args.slow_query_ms is not None:
+        logging.basicConfig(level=logging.INFO,
+                            format='%(asctime)s %(levelname)s %(message)s')
+        database.enable_query_log(args.slow_query_ms / 1000)
+
+    if args.metrics_port or args.metrics_file:
+        import metrics
+        metrics.enable()
+        if args.metrics_port:
+            metrics.serve(args.host, args.metrics_port)
+        if args.metrics_file:
+            metrics.SnapshotWriter(args.metrics_file).start()
+
+    server = BankServer(args.db, max_workers=args.workers,
+                        group_commit=args.group_commit,
+                        card_filter=args.card_filter)
+    try:
+        asyncio.run(server.serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
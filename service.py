@@ -0,0 +1,567 @@
+"""
+Headless banking operations, free of any terminal input and output.
+
+Every operation returns a result object or raises a subclass of BankError
+whose message is fit to be shown to the user.
+"""
+from contextlib import nullcontext
+from dataclasses import dataclass
+
+import database
+import issuance
+import luhn
+import pins
+
+
+# Amounts stay exact in JSON clients that use doubles for numbers
+MAX_AMOUNT = 2 ** 53
+
+
+class BankError(Exception):
+    """Base class for errors of banking operations."""
+
+    message = 'Operation failed.'
+
+    def __init__(self, message=None):
+        super().__init__(message or self.message)
+
+
+class WrongCredentialsError(BankError):
+    message = 'Wrong card number or PIN!'
+
+
+class CardNotFoundError(BankError):
+    message = 'Such a card does not exist.'
+
+
+class InvalidCardNumberError(BankError):
+    message = ('Probably you made a mistake in the card number. '
+               'Please try again!')
+
+
+class SameAccountError(BankError):
+    message = 'You can\'t transfer money to the same account!'
+
+
+class InvalidAmountError(BankError):
+    message = 'Amount must be a positive number!'
+
+
+class InsufficientFundsError(BankError):
+    message = 'Not enough money!'
+
+
+class BalanceLimitError(BankError):
+    message = 'The balance would exceed its limit!'
+
+
+class IdempotencyKeyError(BankError):
+    message = 'This idempotency key was used for another request.'
+
+
+@dataclass(frozen=True)
+class Card:
+    """Snapshot of a card stored in the database."""
+
+    number: str
+    pin: str
+    balance: int = 0
+
+
+@dataclass(frozen=True)
+class Transfer:
+    """Outcome of a successful transfer."""
+
+    sender: str
+    receiver: str
+    amount: int
+    balance: int
+
+
+@dataclass(frozen=True)
+class BatchItem:
+    """Outcome of a single payment of a batch transfer."""
+
+    receiver: str
+    amount: int
+    error: BankError = None
+
+
+@dataclass(frozen=True)
+class BatchTransfer:
+    """Outcome of a batch transfer."""
+
+    sender: str
+    items: tuple
+    total: int
+    balance: int
+
+
+@dataclass(frozen=True)
+class LedgerEntry:
+    """Single booking on an account."""
+
+    id: int
+    account: str
+    counterparty: str
+    amount: int
+    kind: str
+    created_at: str
+
+
+class BankService:
+    """Banking operations on top of a database connection."""
+
+    def __init__(self, connection, cache=None, card_filter=None,
+                 writer=None, pin_hasher=None, pin_verifier=None,
+                 locks=None, results=None):
+        """Initialize the service.
+
+        Args:
+            connection (obj): Connection object
+            cache (LRUCache): optional cache of Card objects by number,
+                may be shared by services of different threads
+            card_filter (BloomFilter): optional filter of all existing card
+                numbers, lets lookups of unknown numbers skip the database;
+                only valid while all cards are created through services
+                sharing the filter, which rebuild it when it needs to
+            writer (GroupCommitWriter): optional writer batching deposits
+                and transfers of many services into shared commits
+            pin_hasher (PinHasher): hasher of new PINs, scrypt by default
+            pin_verifier (PinVerifier): optional process pool verifying
+                PINs at login and hashing new ones, both run in the
+                calling thread otherwise
+            locks (LockManager): optional per-account locks serializing
+                balance changes of services sharing them, each change and
+                the balance read after it then see no one else's writes
+            results (LRUCache): optional cache of recent outcomes of
+                deposits and transfers by idempotency key, answers
+                retries without a database round trip
+        """
+        self.connection = connection
+        self.cache = cache
+        self.card_filter = card_filter
+        self.writer = writer
+        self.pin_hasher = pin_hasher or pins.PinHasher()
+        self.pin_verifier = pin_verifier
+        self.locks = locks
+        self.results = results
+
+    def _locked(self, *numbers):
+        if self.locks is None:
+            return nullcontext()
+        return self.locks.lock(*numbers)
+
+    def _invalidate(self, *numbers):
+        if self.cache is not None:
+            self.cache.invalidate(*numbers)
+
+    def _maintain_filter(self):
+        if self.card_filter is not None and self.card_filter.needs_rebuild():
+            self.card_filter.rebuild(self.connection)
+
+    @staticmethod
+    def _check_number(number):
+        if not issuance.is_card_number(number):
+            raise CardNotFoundError
+
+    @staticmethod
+    def _check_amount(amount):
+        if amount <= 0:
+            raise InvalidAmountError
+        if amount > MAX_AMOUNT:
+            raise InvalidAmountError(f'Amount must not exceed {MAX_AMOUNT:,}!')
+
+    def _deposit_error(self, number):
+        """Explain why a deposit to `number` changed nothing."""
+        self._invalidate(number)
+        if not self.card_exists(number):
+            return CardNotFoundError()
+        return BalanceLimitError()
+
+    def _transfer_error(self, sender, receivers, total):
+        """Explain why a transfer or batch transfer changed nothing."""
+        self._invalidate(sender, *receivers)
+        if self.get_balance(sender) < total:
+            return InsufficientFundsError()
+        existing = database.get_existing_numbers(self.connection,
+                                                 sorted(set(receivers)))
+        if len(existing) < len(set(receivers)):
+            return CardNotFoundError()
+        return BalanceLimitError()
+
+    def create_account(self, pin=None, pin_hash=None):
+        """Issue a new card.
+
+        Args:
+            pin (str): PIN of the new card, random by default
+            pin_hash (str): hash of `pin` made by the caller, e.g. without
+                blocking an event loop; hashed here by default
+
+        Returns:
+            Card: the new card with its number and plaintext PIN, only
+                the PIN's hash is stored
+        """
+        if pin is None:
+            pin, = issuance.get_pins(1)
+        if pin_hash is None and self.pin_verifier is None:
+            pin_hash = self.pin_hasher.hash(pin)
+        elif pin_hash is None:
+            pin_hash = self.pin_verifier.hash(self.pin_hasher, pin)
+
+        number, = issuance.allocate_numbers(self.connection, 1)
+        database.add_card(self.connection, number, pin_hash)
+        if self.card_filter is not None:
+            self.card_filter.add(number)
+            self._maintain_filter()
+
+        return Card(number, pin)
+
+    def _run_once(self, key, request, operation, args, accounts):
+        """Apply a deposit or transfer at most once per idempotency key.
+
+        Args:
+            key (str): idempotency key chosen by the client
+            request (str): description of the request
+            operation (callable): `database.deposit` or `database.move`
+            args (tuple): arguments of the operation
+            accounts (tuple): numbers of the affected accounts, the
+                balance of the first one is the result
+
+        Returns:
+            int: balance of the first account right after the operation,
+                None if the operation failed
+
+        Raises:
+            IdempotencyKeyError: if the key was used for another request
+        """
+        saved = None if self.results is None else self.results.get(key)
+        if saved is None:
+            if self.writer is None:
+                saved = database.run_once(self.connection, key, request,
+                                          operation, args, accounts[0])
+            else:
+                saved = self.writer.submit_once(key, request, operation,
+                                                args, accounts[0]).result()
+            self._invalidate(*accounts)
+            if saved is None:
+                return None
+            if self.results is not None:
+                self.results.put(key, saved)
+
+        saved_request, balance = saved
+        if saved_request != request:
+            raise IdempotencyKeyError
+
+        return balance
+
+    @staticmethod
+    def _scoped_key(account, key):
+        """Prefix a client's idempotency key with its account number.
+
+        Clients choose their keys independently, so without a scope one
+        client's key could replay another client's result.
+        """
+        return f'{account}:{key}'
+
+    def _saved_result(self, key, request):
+        """Look up the outcome of an earlier request with the same key.
+
+        Retries are answered before any validation, so that a retry still
+        gets the original result after the accounts changed, e.g. when the
+        receiver was closed in the meantime.
+
+        Returns:
+            int: saved balance, None if the key is unused
+
+        Raises:
+            IdempotencyKeyError: if the key was used for another request
+        """
+        saved = None if self.results is None else self.results.get(key)
+        if saved is None:
+            saved = database.get_idempotent_result(self.connection, key)
+            if saved is None:
+                return None
+            if self.results is not None:
+                self.results.put(key, saved)
+
+        saved_request, balance = saved
+        if saved_request != request:
+            raise IdempotencyKeyError
+
+        return balance
+
+    def get_card(self, number):
+        """Get a card by its number.
+
+        Raises:
+            CardNotFoundError: if there is no such card
+        """
+        self._check_number(number)
+        if self.card_filter is not None and number not in self.card_filter:
+            raise CardNotFoundError
+
+        if self.cache is None:
+            row = database.get_card_by_number(self.connection, number)
+        else:
+            card = self.cache.get(number)
+            if card is not None:
+                return card
+
+            epoch = self.cache.epoch()
+            row = database.get_card_by_number(self.connection, number)
+            if row:
+                self.cache.put(number, Card(*row[0]), epoch)
+
+        if not row:
+            raise CardNotFoundError
+
+        return Card(*row[0])
+
+    def login(self, number, pin):
+        """Check card credentials.
+
+        Returns:
+            Card: the logged in card
+
+        Raises:
+            WrongCredentialsError: if the card or PIN doesn't match
+        """
+        try:
+            card = self.get_card(number)
+            stored = card.pin
+        except CardNotFoundError:
+            card = None
+            stored = self.pin_hasher.dummy_hash()
+
+        if self.pin_verifier is None:
+            verified = pins.verify_pin(pin, stored)
+        else:
+            verified = self.pin_verifier.verify(number, pin, stored)
+
+        if card is None or not verified:
+            raise WrongCredentialsError
+
+        return card
+
+    def get_balance(self, number):
+        """Get the current balance of an account."""
+        return self.get_card(number).balance
+
+    def add_income(self, number, income, idempotency_key=None):
+        """Deposit money to an account.
+
+        Args:
+            number (str): account number
+            income (int): money to be deposited
+            idempotency_key (str): optional key identifying the deposit
+                among those to the same account, a retry with the same key
+                returns the original balance instead of depositing again
+
+        Returns:
+            int: the account's balance after the deposit
+
+        Raises:
+            BankError: if the account doesn't exist, the amount isn't
+                positive or too large, the balance would exceed its limit
+                or the key was used for another request
+        """
+        request = f'deposit {number} {income}'
+        if idempotency_key is not None:
+            idempotency_key = self._scoped_key(number, idempotency_key)
+            balance = self._saved_result(idempotency_key, request)
+            if balance is not None:
+                return balance
+
+        self._check_number(number)
+        self._check_amount(income)
+
+        if idempotency_key is not None:
+            with self._locked(number):
+                balance = self._run_once(
+                    idempotency_key, request, database.deposit,
+                    (number, income), (number,)
+                )
+                if balance is None:
+                    raise self._deposit_error(number)
+            return balance
+
+        with self._locked(number):
+            if self.writer is None:
+                added = database.add_income(self.connection, number, income)
+            else:
+                added = self.writer.submit_deposit(number, income).result()
+
+            if not added:
+                raise self._deposit_error(number)
+            self._invalidate(number)
+
+            return self.get_balance(number)
+
+    def get_history(self, number, limit=100, before_id=None):
+        """Get the newest ledger entries of an account.
+
+        Returns:
+            list: LedgerEntry objects, newest first
+        """
+        rows = database.get_history(self.connection, number, limit, before_id)
+        return [LedgerEntry(*row) for row in rows]
+
+    def check_receiver(self, sender, receiver):
+        """Check that money can be transferred from `sender` to `receiver`.
+
+        Raises:
+            SameAccountError: if both numbers are the same
+            InvalidCardNumberError: if the receiver isn't a 16-digit number
+                or fails Luhn algorithm
+            CardNotFoundError: if the receiver doesn't exist
+        """
+        if receiver == sender:
+            raise SameAccountError
+        if not (issuance.is_card_number(receiver)
+                and luhn.is_valid(receiver)):
+            raise InvalidCardNumberError
+        if not self.card_exists(receiver):
+            raise CardNotFoundError
+
+    def transfer_money(self, sender, receiver, amount, idempotency_key=None):
+        """Transfer money to another account.
+
+        Args:
+            sender (str): sender's account number
+            receiver (str): receiver's account number
+            amount (int): money to be transferred
+            idempotency_key (str): optional key identifying the transfer
+                among those of the same sender, a retry with the same key
+                returns the original result instead of transferring again
+
+        Returns:
+            Transfer: the transfer with the sender's new balance
+
+        Raises:
+            BankError: if the receiver is invalid, the amount isn't
+                positive or too large, the sender doesn't have enough
+                money, the receiver's balance would exceed its limit or
+                the key was used for another request
+        """
+        request = f'transfer {sender} {receiver} {amount}'
+        if idempotency_key is not None:
+            idempotency_key = self._scoped_key(sender, idempotency_key)
+            balance = self._saved_result(idempotency_key, request)
+            if balance is not None:
+                return Transfer(sender, receiver, amount, balance)
+
+        self._check_number(sender)
+        self.check_receiver(sender, receiver)
+        self._check_amount(amount)
+
+        if idempotency_key is not None:
+            with self._locked(sender, receiver):
+                balance = self._run_once(
+                    idempotency_key, request, database.move,
+                    (sender, receiver, amount), (sender, receiver)
+                )
+                if balance is None:
+                    raise self._transfer_error(sender, [receiver], amount)
+            return Transfer(sender, receiver, amount, balance)
+
+        with self._locked(sender, receiver):
+            if self.writer is None:
+                moved = database.transfer(self.connection, sender, receiver,
+                                          amount)
+            else:
+                moved = self.writer.submit_transfer(sender, receiver,
+                                                    amount).result()
+
+            if not moved:
+                raise self._transfer_error(sender, [receiver], amount)
+            self._invalidate(sender, receiver)
+
+            return Transfer(sender, receiver, amount,
+                            self.get_balance(sender))
+
+    def transfer_batch(self, sender, items):
+        """Pay many receivers from one account at once.
+
+        All items are validated up front, the existence of all receivers
+        with a single query. Invalid items are reported and skipped, the
+        valid ones are applied in one transaction: all of them, or none
+        if the sender can't pay their total.
+
+        Args:
+            sender (str): sender's account number
+            items (iterable): (receiver's account number, amount) pairs
+
+        Returns:
+            BatchTransfer: outcome of every item, in order, the total
+                transferred and the sender's new balance
+
+        Raises:
+            InsufficientFundsError: if the sender can't pay all valid items
+            CardNotFoundError: if a receiver was closed in the meantime
+            BalanceLimitError: if a receiver's balance would exceed its
+                limit
+        """
+        self._check_number(sender)
+        items = [(str(receiver), amount) for receiver, amount in items]
+        is_valid = luhn.validate_batch([receiver for receiver, _ in items])
+        errors = []
+        for (receiver, amount), valid_number in zip(items, is_valid):
+            if receiver == sender:
+                errors.append(SameAccountError())
+            elif not valid_number or not issuance.is_card_number(receiver):
+                errors.append(InvalidCardNumberError())
+            elif not 0 < amount <= MAX_AMOUNT:
+                errors.append(InvalidAmountError())
+            else:
+                errors.append(None)
+
+        receivers = sorted({receiver for (receiver, _), error
+                            in zip(items, errors) if error is None})
+        existing = database.get_existing_numbers(self.connection, receivers)
+        for i, (receiver, _) in enumerate(items):
+            if errors[i] is None and receiver not in existing:
+                errors[i] = CardNotFoundError()
+
+        valid = [item for item, error in zip(items, errors) if error is None]
+        total = sum(amount for _, amount in valid)
+        if total > database.MAX_BALANCE:
+            raise InsufficientFundsError
+
+        with self._locked(sender, *existing):
+            if valid and self.writer is None:
+                moved = database.transfer_many(self.connection, sender, valid)
+            elif valid:
+                moved = self.writer.submit_transfers(sender, valid).result()
+            else:
+                moved = True
+            self._invalidate(sender, *existing)
+
+            if not moved:
+                raise self._transfer_error(sender, [r for r, _ in valid],
+                                           total)
+            balance = self.get_balance(sender)
+
+        return BatchTransfer(sender, tuple(
+            BatchItem(receiver, amount, error)
+            for (receiver, amount), error in zip(items, errors)
+        ), total, balance)
+
+    def delete_account(self, number):
+        """Close an account."""
+        self._check_number(number)
+        with self._locked(number):
+            database.delete_card(self.connection, number)
+            self._invalidate(number)
+        if self.card_filter is not None:
+            self.card_filter.discard(number)
+            self._maintain_filter()
+
+    def card_exists(self, number):
+        """Check that the card number exists in the database."""
+        try:
+            self.get_card(number)
+        except CardNotFoundError:
+            return False
+
+        return True
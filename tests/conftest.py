@@ -0,0 +1,32 @@
+import os
+import sys
+
+import pytest
+
+# The modules live at the top of the repository, not in a package
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import database  # noqa: E402
+
+
+CARDS = [
+    ('4000000000000002', '1111'),
+    ('4000000000000010', '2222'),
+    ('4000000000000028', '3333'),
+]
+
+
+@pytest.fixture(params=[False, True], ids=['text', 'integer'])
+def connection(request, tmp_path):
+    """Connection to a fresh database holding CARDS with 100 each.
+
+    Every test using it runs with both TEXT and INTEGER card numbers.
+    """
+    connection = database.connect(str(tmp_path / 'card.s3db'))
+    database.create_table(connection, integer_numbers=request.param)
+    database.add_cards(connection, CARDS)
+    for number, _ in CARDS:
+        database.add_income(connection, number, 100)
+
+    yield connection
+    connection.close()
@@ -0,0 +1,62 @@
+import os
+
+import pytest
+
+import backup
+import database
+from conftest import CARDS
+
+
+A, B, _ = (number for number, _ in CARDS)
+
+
+def balances(connection):
+    return {number: balance
+            for number, _, balance in database.get_all_cards(connection)}
+
+
+def test_backup_and_restore(connection, tmp_path):
+    db_filepath = str(tmp_path / 'card.s3db')
+    backup_filepath = str(tmp_path / 'card.bak')
+    progress = []
+
+    report = backup.backup(db_filepath, backup_filepath, pages=1, sleep=0,
+                           progress=lambda *step: progress.append(step))
+
+    assert report.pages > 1 and report.size == os.path.getsize(
+        backup_filepath)
+    assert progress[-1] == (report.pages, report.pages)
+    assert backup.check_integrity(backup_filepath) == []
+    assert not os.path.exists(f'{backup_filepath}.tmp')
+
+    database.transfer(connection, A, B, 50)
+    backup.restore(backup_filepath, db_filepath)
+
+    assert balances(connection) == {number: 100 for number, _ in CARDS}
+    assert database.rebuild_balances(connection) == 0
+
+
+def test_missing_database_creates_nothing(tmp_path):
+    with pytest.raises(FileNotFoundError):
+        backup.backup(str(tmp_path / 'mistyped.s3db'),
+                      str(tmp_path / 'card.bak'))
+
+    assert os.listdir(tmp_path) == []
+
+
+def test_corrupt_backups_are_not_restored(connection, tmp_path):
+    backup_filepath = str(tmp_path / 'card.bak')
+    with open(backup_filepath, 'wb') as f:
+        f.write(b'SQLite format 3\0' + b'\xff' * 4096)
+
+    assert backup.check_integrity(backup_filepath)
+    with pytest.raises(backup.IntegrityError):
+        backup.restore(backup_filepath, str(tmp_path / 'card.s3db'))
+
+    assert balances(connection) == {number: 100 for number, _ in CARDS}
+
+
+def test_check_reports_missing_files(tmp_path):
+    filepath = str(tmp_path / 'card.bak')
+
+    assert backup.check_integrity(filepath) == [f'{filepath} does not exist']
@@ -0,0 +1,84 @@
+import sqlite3
+
+import pytest
+
+from bloom import BloomFilter
+from conftest import CARDS
+from service import BankService, CardNotFoundError
+
+
+MISSING = '4000000000000036'
+
+
+def test_added_items_are_always_found():
+    bloom = BloomFilter(1000)
+    items = [str(i) for i in range(1000)]
+
+    bloom.update(items)
+
+    assert all(item in bloom for item in items)
+    false_positives = sum(str(i) in bloom for i in range(1000, 11000))
+    assert false_positives < 300
+
+
+def test_needs_rebuild():
+    bloom = BloomFilter(4)
+    bloom.update('abcd')
+    assert not bloom.needs_rebuild()
+
+    bloom.discard('a')
+    assert not bloom.needs_rebuild()
+    bloom.discard('b')
+    assert bloom.needs_rebuild()
+
+    bloom = BloomFilter(4)
+    bloom.update('abcde')
+    assert bloom.needs_rebuild()
+
+
+def test_rebuild_keeps_items_added_meanwhile(connection, monkeypatch):
+    bloom = BloomFilter.from_connection(connection)
+    bloom.discard(CARDS[0][0])
+    from_connection = BloomFilter.from_connection
+
+    def racing_from_connection(*args, **kwargs):
+        fresh = from_connection(*args, **kwargs)
+        # A card created by another thread while the database was read
+        bloom.add(MISSING)
+        return fresh
+
+    monkeypatch.setattr(BloomFilter, 'from_connection',
+                        racing_from_connection)
+    assert bloom.rebuild(connection)
+
+    assert MISSING in bloom
+    assert all(number in bloom for number, _ in CARDS)
+    assert (bloom.count, bloom.deleted) == (len(CARDS) + 1, 0)
+    assert bloom._added is None
+
+
+def test_rebuild_failure_leaves_the_filter_usable(connection, monkeypatch):
+    bloom = BloomFilter.from_connection(connection)
+
+    def failing_from_connection(*args, **kwargs):
+        raise sqlite3.OperationalError('database is locked')
+
+    monkeypatch.setattr(BloomFilter, 'from_connection',
+                        failing_from_connection)
+    with pytest.raises(sqlite3.OperationalError):
+        bloom.rebuild(connection)
+
+    bloom.add(MISSING)
+    assert MISSING in bloom
+    assert bloom._added is None
+
+
+def test_service_answers_unknown_cards_from_the_filter(connection):
+    service = BankService(connection,
+                          card_filter=BloomFilter.from_connection(connection))
+
+    with pytest.raises(CardNotFoundError):
+        service.get_card(MISSING)
+    card = service.create_account()
+
+    assert service.get_card(card.number).balance == 0
@@ -0,0 +1,79 @@
+import database
+from cache import LRUCache
+from conftest import CARDS
+from service import BankService
+
+
+A, B, _ = (number for number, _ in CARDS)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_least_recently_used_entries_are_evicted():
+    cache = LRUCache(maxsize=2)
+    cache.put('a', 1)
+    cache.put('b', 2)
+    assert cache.get('a') == 1
+
+    cache.put('c', 3)
+
+    assert cache.get('b') is None
+    assert (cache.get('a'), cache.get('c')) == (1, 3)
+    assert cache.stats() == {'hits': 3, 'misses': 1, 'evictions': 1,
+                             'size': 2, 'maxsize': 2}
+
+
+def test_entries_expire():
+    clock = FakeClock()
+    cache = LRUCache(ttl=10, clock=clock)
+    cache.put('a', 1)
+
+    clock.now = 9.9
+    assert cache.get('a') == 1
+    clock.now = 10
+    assert cache.get('a', 'gone') == 'gone'
+    assert len(cache) == 0
+
+
+def test_values_loaded_before_an_invalidation_are_dropped():
+    cache = LRUCache()
+    epoch = cache.epoch()
+    cache.invalidate('other')
+
+    cache.put('a', 'stale', epoch)
+    assert cache.get('a') is None
+
+    cache.put('a', 'fresh', cache.epoch())
+    assert cache.get('a') == 'fresh'
+
+
+def test_clear_drops_pending_loads():
+    cache = LRUCache()
+    cache.put('a', 1)
+    epoch = cache.epoch()
+
+    cache.clear()
+    cache.put('b', 2, epoch)
+
+    assert len(cache) == 0
+
+
+def test_service_never_caches_a_balance_older_than_a_write(connection):
+    cache = LRUCache()
+    service = BankService(connection, cache=cache)
+    assert service.get_card(A).balance == 100
+
+    # A lookup that raced with this transfer must not cache its result
+    epoch = cache.epoch()
+    stale = database.get_card_by_number(connection, B)[0]
+    service.transfer_money(A, B, 30)
+    cache.put(B, stale, epoch)
+
+    assert service.get_card(A).balance == 70
+    assert service.get_card(B).balance == 130
@@ -0,0 +1,211 @@
+import logging
+
+import pytest
+
+import database
+from cache import LRUCache
+from conftest import CARDS
+from service import (BankService, CardNotFoundError, IdempotencyKeyError,
+                     InsufficientFundsError, InvalidCardNumberError)
+
+
+A, B, C = (number for number, _ in CARDS)
+MISSING = '4000000000000036'
+
+
+def balances(connection):
+    return {number: balance
+            for number, _, balance in database.get_all_cards(connection)}
+
+
+def ledger_total(connection):
+    return connection.execute('SELECT SUM(amount) FROM ledger;').fetchone()[0]
+
+
+def test_transfer(connection):
+    assert database.transfer(connection, A, B, 30)
+
+    assert balances(connection) == {A: 70, B: 130, C: 100}
+    assert ledger_total(connection) == 300
+
+
+@pytest.mark.parametrize('dst, amount', [
+    (B, 101),
+    (MISSING, 30),
+    (B, 0),
+    (B, -30),
+])
+def test_failed_transfer_changes_nothing(connection, dst, amount):
+    before = balances(connection)
+
+    assert not database.transfer(connection, A, dst, amount)
+
+    assert balances(connection) == before
+    assert ledger_total(connection) == 300
+    assert not connection.in_transaction
+
+
+def test_move_keeps_the_callers_transaction(connection):
+    with connection as c:
+        c.execute(database.BEGIN_IMMEDIATE)
+        assert not database.move(c, A, MISSING, 10)
+        assert database.move(c, A, B, 5)
+
+    assert balances(connection) == {A: 95, B: 105, C: 100}
+
+
+
+
+
+def test_transfer_many(connection):
+    assert database.transfer_many(connection, A, [(B, 10), (C, 20)])
+
+    assert balances(connection) == {A: 70, B: 110, C: 120}
+    assert ledger_total(connection) == 300
+
+
+@pytest.mark.parametrize('items', [
+    [(B, 60), (C, 60)],
+    [(B, 10), (MISSING, 10)],
+    [(B, 50), (C, -20)],
+])
+def test_failed_move_many_rolls_back(connection, items):
+    before = balances(connection)
+    with connection as c:
+        c.execute(database.BEGIN_IMMEDIATE)
+        assert not database.move_many(c, A, items)
+        # The caller's transaction stays usable after the rollback
+        assert database.move(c, A, B, 5)
+
+    assert balances(connection) == {**before, A: 95, B: 105}
+    assert ledger_total(connection) == 300
+
+
+def test_transfer_batch_skips_invalid_items(connection):
+    service = BankService(connection)
+
+    batch = service.transfer_batch(A, [
+        (B, 10), (A, 10), ('4000000000000003', 10), (C, 0), (MISSING, 10),
+        (C, 20), (B, 5),
+    ])
+
+    assert [type(item.error).__name__ for item in batch.items] == [
+        'NoneType', 'SameAccountError', 'InvalidCardNumberError',
+        'InvalidAmountError', 'CardNotFoundError', 'NoneType', 'NoneType',
+    ]
+    assert (batch.total, batch.balance) == (35, 65)
+    assert balances(connection) == {A: 65, B: 115, C: 120}
+    assert ledger_total(connection) == 300
+
+
+def test_transfer_batch_is_all_or_nothing(connection):
+    service = BankService(connection)
+
+    with pytest.raises(InsufficientFundsError):
+        service.transfer_batch(A, [(B, 60), (C, 60)])
+
+    assert balances(connection) == {A: 100, B: 100, C: 100}
+
+def test_run_once_replays_the_saved_result(connection):
+    args = (A, B, 30)
+    first = database.run_once(connection, 'key', 'request', database.move,
+                              args, A)
+    again = database.run_once(connection, 'key', 'request', database.move,
+                              args, A)
+
+    assert first == again == ('request', 70)
+    assert balances(connection)[A] == 70
+    assert database.get_idempotent_result(connection, 'key') == first
+
+
+def test_failed_run_once_can_be_retried(connection):
+    args = (A, B, 150)
+    assert database.run_once(connection, 'key', 'request', database.move,
+                             args, A) is None
+    assert database.get_idempotent_result(connection, 'key') is None
+
+    database.add_income(connection, A, 100)
+    assert database.run_once(connection, 'key', 'request', database.move,
+                             args, A) == ('request', 50)
+
+
+@pytest.mark.parametrize('cached', [False, True], ids=['db', 'cache'])
+def test_idempotency_keys_are_scoped_per_account(connection, cached):
+    service = BankService(connection, results=LRUCache() if cached else None)
+
+    assert service.transfer_money(A, C, 10, 'key').balance == 90
+    assert service.transfer_money(B, C, 20, 'key').balance == 80
+    assert service.add_income(C, 5, 'key') == 135
+    assert service.transfer_money(A, C, 10, 'key').balance == 90
+    with pytest.raises(IdempotencyKeyError):
+        service.transfer_money(B, C, 25, 'key')
+
+    assert balances(connection) == {A: 90, B: 80, C: 135}
+
+def test_lookups_return_text_numbers(connection):
+    assert database.get_card_by_number(connection, A) == [(A, '1111', 100)]
+    assert database.get_existing_numbers(connection, [A, MISSING]) == {A}
+    assert [row[0] for row in database.iter_cards(connection)] == [A, B, C]
+
+
+def test_migrate_to_integer_numbers(tmp_path):
+    connection = database.connect(str(tmp_path / 'card.s3db'))
+    database.create_table(connection)
+    database.add_cards(connection, CARDS)
+
+    assert database.migrate_to_integer_numbers(connection)
+    assert database.has_integer_numbers(connection)
+    assert database.get_card_by_number(connection, B) == [(B, '2222', 0)]
+    assert not database.migrate_to_integer_numbers(connection)
+    connection.close()
+
+
+def test_migration_keeps_the_id_sequence(tmp_path):
+    connection = database.connect(str(tmp_path / 'card.s3db'))
+    database.create_table(connection)
+    database.add_cards(connection, CARDS)
+    database.delete_card(connection, C)
+
+    assert database.migrate_to_integer_numbers(connection)
+    database.add_card(connection, MISSING, '4444')
+
+    ids = dict(connection.execute('SELECT number, id FROM card;'))
+    assert ids == {int(A): 1, int(B): 2, int(MISSING): 4}
+    connection.close()
+
+
+@pytest.mark.parametrize('number', ['0' + A, A + '.0', f' {A}', int(A)])
+def test_service_rejects_other_spellings(connection, number):
+    service = BankService(connection)
+
+    with pytest.raises(CardNotFoundError):
+        service.get_card(number)
+    with pytest.raises(CardNotFoundError):
+        service.add_income(number, 10)
+    with pytest.raises(InvalidCardNumberError):
+        service.transfer_money(A, number, 10)
+    assert balances(connection)[A] == 100
+
+def test_delete_card_books_the_balance(connection):
+    database.delete_card(connection, A)
+
+    assert A not in balances(connection)
+    assert ledger_total(connection) == 200
+    assert database.rebuild_balances(connection) == 0
+
+
+@pytest.mark.parametrize('sql, full_scan', [
+    (database.REBUILD_BALANCES, False),
+    ('SELECT balance FROM card WHERE number = ?;', False),
+    ('SELECT SUM(balance) FROM card;', True),
+    ('SELECT * FROM (SELECT account FROM ledger LIMIT 5) AS t, card '
+     'WHERE t.account = card.pin;', True),
+])
+def test_query_log_warns_about_full_scans(connection, caplog, sql, full_scan):
+    query_log = database.QueryLog(logger=logging.getLogger('test'))
+
+    with caplog.at_level(logging.INFO, logger='test'):
+        query_log.explain(connection, sql, (A,) * sql.count('?'))
+
+    record, = caplog.records
+    assert (record.levelno == logging.WARNING) is full_scan
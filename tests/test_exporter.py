@@ -0,0 +1,88 @@
+import io
+import json
+import os
+import sys
+
+import pytest
+
+import database
+import exporter
+import importer
+from conftest import CARDS
+
+
+EXPECTED = [(i, number, pin, 100)
+            for i, (number, pin) in enumerate(CARDS, 1)]
+
+
+def export(connection, file_format, with_pins):
+    f = io.BytesIO() if file_format == 'columnar' else io.StringIO()
+    count = exporter.export_cards(connection, f, file_format, with_pins,
+                                  batch_size=2)
+    f.seek(0)
+    return count, f
+
+
+@pytest.mark.parametrize('file_format', ['csv', 'jsonl'])
+def test_exports_with_pins_can_be_imported(connection, tmp_path,
+                                           file_format):
+    count, f = export(connection, file_format, True)
+
+    target = database.connect(str(tmp_path / 'copy.s3db'))
+    database.create_table(target)
+    rows = importer.READERS[file_format](f)
+    report = importer.import_cards(target, rows, plaintext_pins=True)
+
+    assert count == report.imported == len(CARDS)
+    assert database.get_all_cards(target) == [
+        (number, pin, balance) for _, number, pin, balance in EXPECTED
+    ]
+    target.close()
+
+
+def test_csv_without_pins(connection):
+    _, f = export(connection, 'csv', False)
+
+    assert f.read().splitlines() == ['number,balance'] + [
+        f'{number},100' for number, _ in CARDS
+    ]
+
+
+@pytest.mark.parametrize('with_pins', [False, True])
+def test_columnar_round_trip(connection, with_pins):
+    count, f = export(connection, 'columnar', with_pins)
+
+    rows = list(exporter.read_columnar(f))
+
+    assert count == len(CARDS)
+    assert rows == [(i, number, pin if with_pins else None, balance)
+                    for i, number, pin, balance in EXPECTED]
+
+
+def test_gzip_export(connection, tmp_path, monkeypatch):
+    db_filepath = str(tmp_path / 'card.s3db')
+    filepath = str(tmp_path / 'cards.jsonl.gz')
+    monkeypatch.setattr(sys, 'argv', ['exporter.py', filepath,
+                                      '--db', db_filepath])
+
+    exporter.main()
+
+    with importer.open_text(filepath) as f:
+        records = [json.loads(line) for line in f]
+    assert records == [{'number': number, 'balance': 100}
+                       for number, _ in CARDS]
+    assert not os.path.exists(str(tmp_path / 'cards.jsonl.tmp.gz'))
+
+
+def test_missing_database_is_reported(tmp_path, monkeypatch, capsys):
+    db_filepath = str(tmp_path / 'mistyped.s3db')
+    monkeypatch.setattr(sys, 'argv', ['exporter.py',
+                                      str(tmp_path / 'cards.csv'),
+                                      '--db', db_filepath])
+
+    with pytest.raises(SystemExit) as e:
+        exporter.main()
+
+    assert e.value.code == 1
+    assert capsys.readouterr().out == f'{db_filepath} does not exist\n'
+    assert os.listdir(tmp_path) == []
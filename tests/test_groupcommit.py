@@ -0,0 +1,77 @@
+import pytest
+
+import database
+from conftest import CARDS
+from groupcommit import GroupCommitWriter
+
+
+A, B, C = (number for number, _ in CARDS)
+MISSING = '4000000000000036'
+
+
+@pytest.fixture
+def pool(connection, tmp_path):
+    # The connection fixture has filled the database already
+    return database.ConnectionPool(str(tmp_path / 'card.s3db'))
+
+
+def balances(connection):
+    return {number: balance
+            for number, _, balance in database.get_all_cards(connection)}
+
+
+def run_batch(pool, submit):
+    """Submit operations while the writer waits, so they share a batch."""
+    writer = GroupCommitWriter(pool, max_delay=60)
+    futures = submit(writer)
+    writer.close()
+    return writer, futures
+
+
+def test_operations_share_a_transaction(pool, connection):
+    writer, futures = run_batch(pool, lambda writer: [
+        writer.submit_deposit(A, 10),
+        writer.submit_transfer(A, B, 50),
+        writer.submit_transfer(C, B, 500),
+        writer.submit_transfers(C, [(A, 1), (B, 2)]),
+        writer.submit_once('key', 'deposit 5', database.deposit, (C, 5), C),
+    ])
+
+    assert [future.result() for future in futures] == [
+        True, True, False, True, ('deposit 5', 102)
+    ]
+    assert (writer.batches, writer.operations) == (1, 5)
+    assert balances(connection) == {A: 61, B: 152, C: 102}
+
+
+def test_failing_operation_fails_only_its_own_future(pool, connection):
+    writer, futures = run_batch(pool, lambda writer: [
+        writer.submit_deposit(A, 10),
+        writer.submit_deposit(B, 2 ** 63),
+        # Deposits to A, then fails to read the balance of a missing card
+        writer.submit_once('key', 'deposit 7', database.deposit, (A, 7),
+                           MISSING),
+        writer.submit_transfer(A, C, 5),
+    ])
+
+    assert futures[0].result() is True
+    with pytest.raises(OverflowError):
+        futures[1].result()
+    with pytest.raises(TypeError):
+        futures[2].result()
+    assert futures[3].result() is True
+    assert (writer.batches, writer.operations) == (1, 4)
+    assert balances(connection) == {A: 105, B: 100, C: 105}
+    assert database.get_idempotent_result(connection, 'key') is None
+
+
+def test_cancelled_operations_are_skipped(pool, connection):
+    def submit(writer):
+        futures = [writer.submit_deposit(A, 1), writer.submit_deposit(B, 1)]
+        futures[1].cancel()
+        return futures
+
+    writer, futures = run_batch(pool, submit)
+
+    assert futures[0].result() is True and futures[1].cancelled()
+    assert balances(connection) == {A: 101, B: 100, C: 100}
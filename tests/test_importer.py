@@ -0,0 +1,95 @@
+import io
+import json
+
+import pytest
+
+import database
+import importer
+import pins
+from conftest import CARDS
+
+
+A = CARDS[0][0]
+D, E, F = '4000000000000044', '4000000000000051', '4000000000000069'
+FAST = pins.PinHasher('pbkdf2_sha256', iterations=1000)
+
+CSV = f'''number,pin,balance
+{D},1234,10
+{E},{FAST.hash('5678')},0
+{F},1234
+{A},1111,5
+{D},4321,99
+4000000000000045,1234,0
+5100000000000016,1234,0
+{F},12345,0
+{F},1234,-1
+{F},1234,99999999999999999999
+{F},1234,1.5
+1,2,3,4
+'''
+
+
+def read_csv(text):
+    return list(importer.read_csv(io.StringIO(text)))
+
+
+def stored(connection, number):
+    rows = database.get_card_by_number(connection, number)
+    return rows[0][1:] if rows else None
+
+
+def test_import_csv(connection):
+    rejected = []
+
+    report = importer.import_cards(connection, read_csv(CSV),
+                                   on_reject=rejected.append,
+                                   plaintext_pins=True)
+
+    assert (report.read, report.imported) == (12, 3)
+    assert rejected == [
+        (5, A, 'card exists'),
+        (6, D, 'duplicate number'),
+        (7, '4000000000000045', 'invalid number'),
+        (8, '5100000000000016', 'unknown issuer'),
+        (9, F, 'invalid PIN'),
+        (10, F, 'invalid balance'),
+        (11, F, 'invalid balance'),
+        (12, F, 'invalid balance'),
+        (13, None, 'malformed row'),
+    ]
+    assert stored(connection, D) == ('1234', 10)
+    assert pins.verify_pin('5678', stored(connection, E)[0])
+    assert stored(connection, F) == ('1234', 0)
+    assert stored(connection, A) == ('1111', 100)
+
+
+def test_import_hashes_plain_pins(connection):
+    report = importer.import_cards(connection, read_csv(CSV), chunk_size=4,
+                                   pin_hasher=FAST, max_workers=2)
+
+    assert (report.imported, report.plaintext_pins) == (3, 0)
+    pin, balance = stored(connection, D)
+    assert pins.verify_pin('1234', pin) and balance == 10
+
+
+@pytest.mark.parametrize('balance', [
+    2 ** 63, '99999999999999999999', True, 1.0, None,
+])
+def test_jsonl_balances_beyond_an_integer_are_rejected(connection, balance):
+    line = json.dumps({'number': D, 'pin': '1234', 'balance': balance})
+    rows = list(importer.read_jsonl(io.StringIO(line + '\n')))
+
+    report = importer.import_cards(connection, rows, plaintext_pins=True)
+
+    assert report.imported == 0
+    assert report.rejected == {'invalid balance': 1}
+
+
+def test_largest_balance_is_accepted(connection):
+    line = json.dumps({'number': D, 'pin': '1234',
+                       'balance': database.MAX_BALANCE})
+    rows = list(importer.read_jsonl(io.StringIO(line + '\n')))
+
+    assert importer.import_cards(connection, rows,
+                                 plaintext_pins=True).imported == 1
+    assert stored(connection, D) == ('1234', database.MAX_BALANCE)
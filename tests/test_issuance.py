@@ -0,0 +1,48 @@
+import pytest
+
+import database
+import issuance
+import luhn
+
+
+@pytest.mark.parametrize('size', [1, 2, 17, 1000, 4096, 10_007])
+def test_permutation_is_a_bijection(size):
+    permutation = issuance.AccountIdPermutation('key', size)
+
+    assert sorted(permutation[i] for i in range(size)) == list(range(size))
+
+
+def test_permutation_depends_on_the_key():
+    first = issuance.AccountIdPermutation('a', 1000)
+    second = issuance.AccountIdPermutation('b', 1000)
+
+    assert [first[i] for i in range(20)] != [second[i] for i in range(20)]
+
+
+def test_permutation_index_out_of_range():
+    permutation = issuance.AccountIdPermutation('key', 10)
+
+    with pytest.raises(IndexError):
+        permutation[10]
+
+
+def test_issued_numbers_are_unique_and_valid(connection):
+    cards = []
+    for count in (1, 500, 1500):
+        cards += issuance.issue_cards(connection, count, plaintext_pins=True)
+
+    numbers = [number for number, _ in cards]
+    assert len(set(numbers)) == len(numbers) == 2001
+    assert all(luhn.validate_batch(numbers))
+    assert all(issuance.is_card_number(number) for number in numbers)
+    assert all(number.startswith(issuance.ISSUER_NUM) for number in numbers)
+    assert database.count_cards(connection) == 2001 + 3
+
+
+def test_issued_cards_store_their_pins(connection):
+    cards = issuance.issue_cards(connection, 10, plaintext_pins=True)
+
+    for number, pin in cards:
+        assert database.get_card_by_number(connection, number) == [
+            (number, pin, 0)
+        ]
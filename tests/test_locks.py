@@ -0,0 +1,82 @@
+import threading
+
+import database
+from conftest import CARDS
+from locks import LockManager
+from service import BankService
+
+
+A, B, C = (number for number, _ in CARDS)
+
+
+def test_duplicates_and_shared_stripes_dont_deadlock():
+    locks = LockManager(stripes=1)
+
+    with locks.lock(A, B, A):
+        assert locks.stripes[0].locked()
+
+    assert not locks.stripes[0].locked()
+
+
+def test_locks_are_released_on_errors():
+    locks = LockManager(stripes=8)
+
+    try:
+        with locks.lock(A, B, C):
+            raise RuntimeError
+    except RuntimeError:
+        pass
+
+    assert not any(lock.locked() for lock in locks.stripes)
+
+
+def test_accounts_are_locked_for_each_other():
+    locks = LockManager()
+    inside = threading.Event()
+    release = threading.Event()
+    entered = []
+
+    def hold():
+        with locks.lock(A):
+            inside.set()
+            release.wait()
+
+    def wait():
+        with locks.lock(B, A):
+            entered.append(True)
+
+    holder = threading.Thread(target=hold)
+    holder.start()
+    inside.wait()
+    waiter = threading.Thread(target=wait)
+    waiter.start()
+
+    waiter.join(0.1)
+    assert not entered
+    release.set()
+    holder.join()
+    waiter.join()
+    assert entered
+
+
+def test_opposite_transfers_keep_the_books(connection, tmp_path):
+    pool = database.ConnectionPool(str(tmp_path / 'card.s3db'))
+    locks = LockManager()
+
+    def transfer(src, dst):
+        with pool.connection() as c:
+            service = BankService(c, locks=locks)
+            for _ in range(50):
+                service.transfer_money(src, dst, 1)
+
+    threads = [threading.Thread(target=transfer, args=pair)
+               for pair in [(A, B), (B, A), (A, C), (C, A)]]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    balances = {number: balance
+                for number, _, balance in database.get_all_cards(connection)}
+    assert balances == {A: 100, B: 100, C: 100}
+    assert database.rebuild_balances(connection) == 0
@@ -0,0 +1,56 @@
+import random
+
+import pytest
+
+import luhn
+
+
+def reference_is_valid(number):
+    """Textbook Luhn check the table-driven versions must agree with."""
+    total = 0
+    for i, digit in enumerate(reversed(number)):
+        value = int(digit) * (2 if i % 2 else 1)
+        total += value - 9 if value > 9 else value
+    return total % 10 == 0
+
+
+@pytest.mark.parametrize('number, valid', [
+    ('4000008449433403', True),
+    ('4000008449433404', False),
+    ('79927398713', True),
+    ('0', True),
+    ('', False),
+    ('4000 0084', False),
+    ('٤٠٠٠', False),
+])
+def test_is_valid(number, valid):
+    assert luhn.is_valid(number) is valid
+
+
+def test_batch_agrees_with_scalar():
+    rng = random.Random(1)
+    numbers = [''.join(rng.choices('0123456789', k=16)) for _ in range(2000)]
+
+    assert luhn.validate_batch(numbers) == [
+        reference_is_valid(number) for number in numbers
+    ]
+
+
+def test_batch_of_mixed_input_falls_back():
+    numbers = ['79927398713', '4000008449433403', 'abc', '', 4000008449433403]
+
+    assert luhn.validate_batch(numbers) == [
+        luhn.is_valid(number) for number in numbers
+    ]
+
+
+def test_complete_batch():
+    rng = random.Random(2)
+    partials = [f'400000{rng.randrange(10 ** 9):09d}' for _ in range(1000)]
+
+    numbers = luhn.complete_batch(partials)
+
+    assert [number[:-1] for number in numbers] == partials
+    assert all(luhn.validate_batch(numbers))
+    assert numbers == [p + luhn.check_digit(p) for p in partials]
+    assert luhn.complete_batch(['7992739871', '12']) == ['79927398713', '125']
@@ -0,0 +1,107 @@
+import pytest
+
+import database
+import issuance
+import pins
+from conftest import CARDS
+from service import BankService, WrongCredentialsError
+
+
+FAST = pins.PinHasher('pbkdf2_sha256', iterations=1000)
+CHEAP_SCRYPT = pins.PinHasher(n=2 ** 4)
+
+
+@pytest.mark.parametrize('hasher', [FAST, CHEAP_SCRYPT])
+def test_hash_and_verify(hasher):
+    stored = hasher.hash('1234')
+
+    assert pins.is_hashed(stored) and pins.is_well_formed(stored)
+    assert stored != hasher.hash('1234')
+    assert pins.verify_pin('1234', stored)
+    assert not pins.verify_pin('1235', stored)
+
+
+def test_plaintext_pins_are_still_accepted():
+    assert not pins.is_hashed('1234')
+    assert pins.verify_pin('1234', '1234')
+    assert not pins.verify_pin('1235', '1234')
+
+
+@pytest.mark.parametrize('stored', [
+    'x',
+    'md5$1$c2FsdA==$aGFzaA==',
+    'pbkdf2_sha256$c2FsdA==$aGFzaA==',
+    'pbkdf2_sha256$0$c2FsdA==$aGFzaA==',
+    'pbkdf2_sha256$1000$not base64$aGFzaA==',
+    'scrypt$16$8$c2FsdA==$aGFzaA==',
+])
+def test_malformed_hashes_match_nothing(stored):
+    assert not pins.is_well_formed(stored)
+    assert not pins.verify_pin('1234', stored)
+
+
+def test_dummy_hash_matches_no_pin():
+    stored = FAST.dummy_hash()
+
+    assert FAST.dummy_hash() == stored and pins.is_well_formed(stored)
+    assert not any(pins.verify_pin(pin, stored)
+                   for pin in issuance.get_pins(100))
+
+
+def test_hash_pins_keeps_the_order():
+    plain = ['0000', '1234', '9999']
+
+    hashes = pins.hash_pins(plain, FAST, max_workers=2)
+
+    assert [pins.verify_pin(pin, stored)
+            for pin, stored in zip(plain, hashes)] == [True] * 3
+
+
+def test_issued_cards_have_hashed_pins(connection):
+    cards = issuance.issue_cards(connection, 3, pin_hasher=FAST,
+                                 max_workers=2)
+
+    stored = dict(database.get_card_by_number(connection, number)[0][:2]
+                  for number, _ in cards)
+    assert all(pins.is_well_formed(stored[number]) for number, _ in cards)
+    assert all(pins.verify_pin(pin, stored[number]) for number, pin in cards)
+
+
+def test_migrate_plaintext_pins(connection):
+    hashed = FAST.hash('9999')
+    with connection as c:
+        c.execute('UPDATE card SET pin = ? WHERE id = 3;', (hashed,))
+
+    assert pins.migrate_plaintext_pins(connection, FAST, max_workers=2,
+                                       batch_size=1) == 2
+    assert pins.migrate_plaintext_pins(connection, FAST) == 0
+
+    stored = {number: pin
+              for number, pin, _ in database.get_all_cards(connection)}
+    assert all(pins.is_hashed(pin) for pin in stored.values())
+    assert pins.verify_pin('1111', stored[CARDS[0][0]])
+    assert stored[CARDS[2][0]] == hashed
+
+
+def test_login(connection):
+    service = BankService(connection, pin_hasher=FAST)
+
+    assert service.login(*CARDS[0]).number == CARDS[0][0]
+    with pytest.raises(WrongCredentialsError):
+        service.login(CARDS[0][0], '0000')
+
+
+def test_login_of_unknown_cards_runs_the_kdf(connection, monkeypatch):
+    service = BankService(connection, pin_hasher=FAST)
+    checked = []
+    verify_pin = pins.verify_pin
+
+    def spy(pin, stored):
+        checked.append(stored)
+        return verify_pin(pin, stored)
+
+    monkeypatch.setattr(pins, 'verify_pin', spy)
+    with pytest.raises(WrongCredentialsError):
+        service.login('4000000000000036', '1111')
+
+    assert checked == [FAST.dummy_hash()]
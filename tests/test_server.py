@@ -0,0 +1,221 @@
+import asyncio
+import contextlib
+import json
+import socket
+
+import pytest
+
+import database
+import issuance
+import pins
+from conftest import CARDS
+from server import BankServer
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def converse(db_filepath, requests, **options):
+    """Send requests to a fresh server over one connection.
+
+    Requests are dicts or raw bytes. Returns the responses, fewer than
+    the requests if the server closed the connection.
+    """
+    async def main():
+        server = BankServer(db_filepath, max_workers=2, **options)
+        port = free_port()
+        task = asyncio.create_task(server.serve('127.0.0.1', port))
+        for _ in range(100):
+            try:
+                reader, writer = await asyncio.open_connection(
+                    '127.0.0.1', port, limit=2 ** 24
+                )
+                break
+            except OSError:
+                await asyncio.sleep(0.05)
+
+        responses = []
+        for request in requests:
+            if isinstance(request, dict):
+                request = json.dumps(request).encode()
+            writer.write(request + b'\n')
+            await writer.drain()
+            line = await reader.readline()
+            if not line:
+                break
+            responses.append(json.loads(line))
+
+        writer.close()
+        task.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await task
+        return responses
+
+    return asyncio.run(main())
+
+
+@pytest.fixture
+def db(tmp_path):
+    """Database holding the CARDS numbers with PIN 1234, the first one
+    with a balance of 1000."""
+    db_filepath = str(tmp_path / 'card.s3db')
+    pin_hash = pins.PinHasher('pbkdf2_sha256', iterations=1000).hash('1234')
+    connection = database.connect(db_filepath)
+    database.create_table(connection)
+    database.add_cards(connection, [(number, pin_hash)
+                                    for number, _ in CARDS[:2]])
+    database.add_income(connection, CARDS[0][0], 1000)
+    connection.close()
+    return db_filepath, [number for number, _ in CARDS[:2]]
+
+
+def login(number):
+    return {'op': 'login', 'number': number, 'pin': '1234'}
+
+
+def test_session(db):
+    db_filepath, (a, b) = db
+
+    responses = converse(db_filepath, [
+        {'op': 'balance'},
+        login(a),
+        {'op': 'deposit', 'amount': 50},
+        {'op': 'transfer', 'receiver': b, 'amount': 300},
+        {'op': 'transfer_batch', 'transfers': [
+            {'receiver': b, 'amount': 100},
+            {'receiver': b, 'amount': -1},
+            {'receiver': a, 'amount': 1},
+        ]},
+        {'op': 'balance'},
+        {'op': 'logout'},
+        {'op': 'balance'},
+    ])
+
+    assert responses[0]['error'] == 'RequestError'
+    assert responses[1] == {'ok': True, 'number': a, 'balance': 1000}
+    assert responses[2] == {'ok': True, 'balance': 1050}
+    assert responses[3] == {'ok': True, 'balance': 750}
+    assert responses[4]['total'] == 100
+    assert [item['ok'] for item in responses[4]['results']] == [
+        True, False, False
+    ]
+    assert responses[5] == {'ok': True, 'balance': 650}
+    assert responses[6] == {'ok': True}
+    assert responses[7]['error'] == 'RequestError'
+
+
+def test_create_account(db):
+    db_filepath, _ = db
+
+    created, = converse(db_filepath, [{'op': 'create_account'}])
+
+    assert created['ok'] and issuance.is_card_number(created['number'])
+    logged_in, = converse(db_filepath, [{
+        'op': 'login', 'number': created['number'], 'pin': created['pin']
+    }])
+    assert logged_in == {'ok': True, 'number': created['number'],
+                         'balance': 0}
+
+
+@pytest.mark.parametrize('request_line, error', [
+    (b'not json', 'RequestError'),
+    (b'[1, 2]', 'RequestError'),
+    (b'{"op": []}', 'RequestError'),
+    (b'{"op": "steal"}', 'RequestError'),
+    (b'{"op": "login", "number": "4000000000000002", "pin": "1"}',
+     'WrongCredentialsError'),
+    (b'{"op": "login", "number": "4000000000000036", "pin": "1234"}',
+     'WrongCredentialsError'),
+])
+def test_malformed_requests_get_an_error(db, request_line, error):
+    db_filepath, (a, _) = db
+
+    responses = converse(db_filepath, [request_line, login(a)])
+
+    assert responses[0]['ok'] is False
+    assert responses[0]['error'] == error
+    assert responses[1]['ok']
+
+
+@pytest.mark.parametrize('amount', [0, -5, 2 ** 53 + 1, 2 ** 63, 10 ** 30])
+def test_out_of_range_amounts_are_rejected(db, amount):
+    db_filepath, (a, b) = db
+
+    responses = converse(db_filepath, [
+        login(a),
+        {'op': 'deposit', 'amount': amount},
+        {'op': 'transfer', 'receiver': b, 'amount': amount},
+        {'op': 'balance'},
+    ])
+
+    assert [r.get('error') for r in responses[1:3]] == [
+        'InvalidAmountError', 'InvalidAmountError'
+    ]
+    assert responses[3] == {'ok': True, 'balance': 1000}
+
+
+def test_oversized_line_is_answered_and_closes(db):
+    db_filepath, (a, _) = db
+
+    responses = converse(db_filepath, [
+        b'{"op": "login", "pin": "' + b'1' * 2000 + b'"}', login(a)
+    ], max_line=1024)
+
+    assert responses == [{'ok': False, 'error': 'RequestError',
+                          'message': 'Request exceeds 1,024 bytes'}]
+
+
+def test_large_batches_fit_in_a_line(db):
+    db_filepath, (a, b) = db
+    transfers = [{'receiver': b, 'amount': 1}] * 1000
+
+    responses = converse(db_filepath, [
+        login(a), {'op': 'transfer_batch', 'transfers': transfers}
+    ])
+
+    assert responses[1]['ok'] and responses[1]['total'] == 1000
+    assert responses[1]['balance'] == 0
+
+
+def test_balances_stay_integers_at_their_limit(db):
+    db_filepath, (a, b) = db
+    connection = database.connect(db_filepath)
+    with connection as c:
+        c.execute('UPDATE card SET balance = ? WHERE number = ?;',
+                  (database.MAX_BALANCE - 10, b))
+    connection.close()
+
+    responses = converse(db_filepath, [
+        login(a),
+        {'op': 'transfer', 'receiver': b, 'amount': 100},
+        login(b),
+        {'op': 'deposit', 'amount': 11},
+        {'op': 'deposit', 'amount': 10},
+    ])
+
+    assert responses[1]['error'] == 'BalanceLimitError'
+    assert responses[3]['error'] == 'BalanceLimitError'
+    assert responses[4] == {'ok': True, 'balance': database.MAX_BALANCE}
+    connection = database.connect(db_filepath)
+    assert connection.execute(
+        'SELECT typeof(balance), balance FROM card ORDER BY number;'
+    ).fetchall() == [('integer', 1000), ('integer', database.MAX_BALANCE)]
+    connection.close()
+
+
+def test_unexpected_errors_are_answered(db, monkeypatch):
+    db_filepath, (a, _) = db
+
+    def get_balance(self, number):
+        raise RuntimeError('boom')
+
+    monkeypatch.setattr('service.BankService.get_balance', get_balance)
+    responses = converse(db_filepath, [login(a), {'op': 'balance'},
+                                       {'op': 'logout'}])
+
+    assert responses[1] == {'ok': False, 'error': 'InternalError',
+                            'message': 'Internal server error'}
+    assert responses[2] == {'ok': True}